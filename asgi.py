@@ -0,0 +1,161 @@
+# asgi.py
+"""
+ASGI entry point, the Procfile's web-asgi process: uvicorn --factory asgi:create_app.
+
+Flask views stay synchronous and run on ASGI_THREADS threads per worker, so requests are served
+concurrently as under gunicorn's gthread workers (one slow page or live stream never holds up the
+others). What the ASGI server adds is an event loop per worker process: it owns the async
+datastore client, and pages hand it their independent reads to run with asyncio.gather (see
+asyncreads.py), instead of holding a pool thread per read.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import sys
+
+import asyncreads
+import main
+
+# Threads per worker for views and streamed response bodies, like gunicorn's --threads.
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 64))
+
+_END = object()
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ for an ASGI http scope whose request body has been read in full."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path'][len(root_path):] if root_path and scope['path'].startswith(root_path) else scope['path']
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f"HTTP_{key}"
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WsgiBridge:
+    """
+    Serves a WSGI app over ASGI, running it on a thread pool. Buffered responses are read in the
+    same thread as the view; streamed ones (Server-Sent Events) chunk by chunk, and are closed as
+    soon as the client disconnects.
+    """
+
+    def __init__(self, wsgi_app, max_threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads
+        self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type '{scope['type']}'.")
+
+    def _start(self):
+        # Runs on the server's loop, inside the worker process (never in a parent it forks from).
+        if self._executor is None:
+            loop = asyncio.get_running_loop()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='asgi')
+            # Blocking work of gathered reads (local datastores, loads without an async twin) runs here.
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='asgi-reads'))
+            asyncreads.attach_loop(loop)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                asyncreads.detach_loop()
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _call_app(self, environ):
+        """Runs the view; returns (status, headers, iterable, content), content for a buffered response, iterable for a streamed one."""
+        started = []
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+        iterable = self.wsgi_app(environ, start_response)
+        status, headers = started
+        if not any(name.lower() == 'content-length' for name, _ in headers):
+            return status, headers, iterable, None
+        try:
+            return status, headers, None, b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    async def _http(self, scope, receive, send):
+        self._start()
+        loop = asyncio.get_running_loop()
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        status, headers, iterable, content = await loop.run_in_executor(self._executor, self._call_app, wsgi_environ(scope, bytes(body)))
+        await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        if content is not None:
+            await send({'type': 'http.response.body', 'body': content})
+            return
+
+        disconnected = asyncio.Event()
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+        watcher = asyncio.create_task(watch_disconnect())
+        chunks = iter(iterable)
+        try:
+            while not disconnected.is_set():
+                chunk = await loop.run_in_executor(self._executor, next, chunks, _END)
+                if chunk is _END:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            if hasattr(iterable, 'close'):
+                # Quick, so it runs on the loop (also during shutdown): closes the generator and runs
+                # the response's on-close callbacks, e.g. releasing a live stream slot.
+                iterable.close()
+
+
+def create_app():
+    """App factory for uvicorn --factory: the Flask app (see main.create_app) behind WsgiBridge."""
+    return WsgiBridge(main.create_app())
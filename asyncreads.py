@@ -0,0 +1,81 @@
+# asyncreads.py
+"""
+Datastore reads on the worker's event loop, for the ASGI server (asgi.py).
+
+Under asgi.py every worker process runs one event loop, the server's. It owns the async
+datastore client, and gather() hands a page's independent reads to it, where they run as
+coroutines under asyncio.gather; the view's thread waits for all of them at once. A load
+declares its coroutine twin with @async_version and is passed as functools.partial(load, ...);
+anything else runs on a thread of the loop's executor, still overlapping the others.
+Under gunicorn no loop is attached, and main reads through parallelreads.py instead.
+"""
+import asyncio
+import threading
+
+_loop = None
+_local = threading.local()
+
+
+def attach_loop(loop):
+    """Called with the server's running loop once the worker starts (ASGI lifespan startup)."""
+    global _loop
+    _loop = loop
+
+
+def detach_loop():
+    global _loop
+    _loop = None
+
+
+def loop_attached():
+    return _loop is not None and not _loop.is_closed()
+
+
+def async_version(coroutine_function):
+    """Decorator: coroutine_function takes the same arguments as the decorated load and returns the same value."""
+    def decorate(function):
+        function.async_version = coroutine_function
+        return function
+    return decorate
+
+
+def _run_in_thread(function, args):
+    _local.in_loop_thread = True
+    try:
+        return function(*args)
+    finally:
+        _local.in_loop_thread = False
+
+
+async def to_thread(function, *args):
+    """Blocking work from a coroutine. Loads in such a thread that gather again read one by one instead of queueing on the loop."""
+    return await asyncio.to_thread(_run_in_thread, function, args)
+
+
+def _coroutine(loader):
+    coroutine_function = getattr(getattr(loader, 'func', None), 'async_version', None)
+    if coroutine_function is not None:
+        return coroutine_function(*loader.args, **loader.keywords)
+    return to_thread(loader)
+
+
+async def _gather(loaders):
+    return await asyncio.gather(*(_coroutine(loader) for loader in loaders))
+
+
+def _on_loop():
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+def gather(*loaders):
+    """
+    Runs each zero-argument loader concurrently on the worker's loop and returns their results
+    in order. Called from a view's thread, never the loop's own; the first exception propagates.
+    """
+    if len(loaders) < 2 or _on_loop() or getattr(_local, 'in_loop_thread', False):
+        return [loader() for loader in loaders]
+    # The calling thread's context (the Flask request, its Firestore counters) is copied into the tasks.
+    return asyncio.run_coroutine_threadsafe(_gather(loaders), _loop).result()
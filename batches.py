@@ -0,0 +1,20 @@
+# batches.py
+"""Firestore's write limit and the chunked commit every bulk write path goes through."""
+
+# Firestore limit: 500 writes per batch or transaction.
+MAX_BATCH_WRITES = 500
+
+
+def commit_in_chunks(db, writes, operation='update'):
+    """
+    writes: list of (reference, data) pairs, applied with batch.update (or batch.set with
+    operation='set'); data None deletes the document. Commits in as few batches as Firestore allows.
+    """
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref, data in writes[start:start + MAX_BATCH_WRITES]:
+            if data is None:
+                batch.delete(ref)
+            else:
+                getattr(batch, operation)(ref, data)
+        batch.commit()
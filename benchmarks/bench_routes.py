@@ -0,0 +1,263 @@
+# benchmarks/bench_routes.py
+"""
+Load test for the hot paths, run against the local datastore (no Firebase project needed).
+
+Seeds a synthetic pool, then times /standings, /projections, a manager's pick sheet, the /admin
+winner POST and the save_pick POST through Flask's test client, reporting latency percentiles
+and the Firestore reads/writes each request would have cost.
+
+    python benchmarks/bench_routes.py --managers 1000 --matchups 50 --decided 20
+
+--latency-ms adds a simulated network round trip to every datastore call; compare
+--parallel-reads on and off with it to see what fetching independent reads in parallel saves.
+--server asgi sends the same requests through asgi.py (as uvicorn would, on one event loop
+thread) instead of the test client, so reads are gathered as coroutines on that loop.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--managers', type=int, default=1000)
+    parser.add_argument('--matchups', type=int, default=50)
+    parser.add_argument('--decided', type=int, default=20, help="Matchups that already have a winner.")
+    parser.add_argument('--iterations', type=int, default=20, help="Requests timed per route.")
+    parser.add_argument('--simulations', type=int, default=None, help="PROJECTION_SIMULATIONS for the run.")
+    parser.add_argument('--datastore', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--file', default='local/bench.sqlite3', help="Database file for --datastore sqlite (recreated).")
+    parser.add_argument('--cache-ttl', type=float, default=None, help="CACHE_TTL_SECONDS for the run (0 disables the cache).")
+    parser.add_argument('--jobs', choices=('inline', 'background'), default='inline',
+                        help="JOBS_MODE for the run; 'inline' includes the snapshot refresh in each write's latency.")
+    parser.add_argument('--pick-storage', choices=('documents', 'sheets'), default='documents',
+                        help="PICK_STORAGE for the run; 'sheets' migrates the seeded picks into pick sheets.")
+    parser.add_argument('--latency-ms', type=float, default=0, help="DATASTORE_LATENCY_MS for the run.")
+    parser.add_argument('--parallel-reads', choices=('on', 'off'), default='on', help="PARALLEL_READS for the run.")
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi',
+                        help="'wsgi' uses Flask's test client, 'asgi' the asgi.py app on an event loop.")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """The app reads its settings at import time, so this runs before main is imported."""
+    os.environ['DATASTORE'] = args.datastore
+    os.environ['SNAPSHOT_STORE'] = 'firestore'
+    os.environ['JOBS_MODE'] = args.jobs
+    os.environ['PICK_STORAGE'] = args.pick_storage
+    os.environ['DATASTORE_LATENCY_MS'] = str(args.latency_ms)
+    os.environ['PARALLEL_READS'] = '1' if args.parallel_reads == 'on' else '0'
+    if args.datastore == 'sqlite':
+        os.environ['DATASTORE_FILE'] = args.file
+        if os.path.exists(args.file):
+            os.remove(args.file)
+    if args.simulations is not None:
+        os.environ['PROJECTION_SIMULATIONS'] = str(args.simulations)
+    if args.cache_ttl is not None:
+        os.environ['CACHE_TTL_SECONDS'] = str(args.cache_ttl)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed_pool(repo, num_managers, num_matchups, num_decided, rng):
+    """Writes managers, matchups and a full, valid pick sheet per manager in as few batches as allowed."""
+    writes = []
+    matchups = []
+    for k in range(num_matchups):
+        matchup = {'id': f'matchup-{k:03d}', 'team1Name': f'Home {k}', 'team2Name': f'Away {k}',
+                   'team1Id': f'home-{k:03d}', 'team2Id': f'away-{k:03d}', 'winnerTeamId': None, 'sortOrder': k + 1}
+        if k < num_decided:
+            matchup['winnerTeamId'] = rng.choice([matchup['team1Id'], matchup['team2Id']])
+        matchups.append(matchup)
+        writes.append((repo.matchups.document(matchup['id']), matchup))
+
+    for i in range(num_managers):
+        manager_id = f'manager-{i:05d}'
+        points = list(range(1, num_matchups + 1))
+        rng.shuffle(points)
+        score = 0
+        for matchup, pick_points in zip(matchups, points):
+            picked_team_id = rng.choice([matchup['team1Id'], matchup['team2Id']])
+            if picked_team_id == matchup['winnerTeamId']:
+                score += pick_points
+            writes.append((repo.picks.document(f"{manager_id}_{matchup['id']}"),
+                           {'managerId': manager_id, 'matchupId': matchup['id'], 'pickedTeamId': picked_team_id, 'points': pick_points}))
+        writes.append((repo.managers.document(manager_id), {'id': manager_id, 'name': f'Manager {i}', 'totalScore': score, 'tieBreakerScore': 40}))
+
+    from batches import commit_in_chunks
+    commit_in_chunks(repo.client, writes, operation='set')
+    return matchups
+
+
+class AsgiResponse:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def get_data(self, as_text=False):
+        return self.body.decode('utf-8') if as_text else self.body
+
+
+class AsgiClient:
+    """Minimal ASGI client: runs the app on an event loop thread after its lifespan startup, like uvicorn."""
+
+    def __init__(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='asgi-loop', daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._startup(), self.loop).result()
+
+    async def _startup(self):
+        self._lifespan_messages = asyncio.Queue()
+        await self._lifespan_messages.put({'type': 'lifespan.startup'})
+        started = asyncio.Event()
+        async def send(message):
+            if message['type'] == 'lifespan.startup.complete':
+                started.set()
+        self._lifespan = asyncio.ensure_future(self.app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, self._lifespan_messages.get, send))
+        await started.wait()
+
+    async def _shutdown(self):
+        await self._lifespan_messages.put({'type': 'lifespan.shutdown'})
+        await self._lifespan
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def _request(self, method, path, headers, body):
+        from werkzeug.datastructures import Headers
+        path, _, query = path.partition('?')
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+                 'path': path, 'query_string': query.encode('latin-1'), 'root_path': '', 'client': ('127.0.0.1', 0),
+                 'server': ('localhost', 80), 'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]}
+        messages = [{'type': 'http.request', 'body': body}]
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()  # the client never disconnects
+        response = {'headers': Headers(), 'body': b''}
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                for name, value in message['headers']:
+                    response['headers'].add(name.decode('latin-1'), value.decode('latin-1'))
+            else:
+                response['body'] += message.get('body', b'')
+        await self.app(scope, receive, send)
+        return AsgiResponse(response['status'], response['headers'], response['body'])
+
+    def request(self, method, path, headers=None, data=None):
+        headers = dict(headers or {})
+        body = b''
+        if data is not None:
+            body = urlencode(data, doseq=True).encode('utf-8')
+            headers.update({'Content-Type': 'application/x-www-form-urlencoded', 'Content-Length': str(len(body))})
+        return asyncio.run_coroutine_threadsafe(self._request(method, path, headers, body), self.loop).result()
+
+    def get(self, path, headers=None):
+        return self.request('GET', path, headers)
+
+    def post(self, path, data=None):
+        return self.request('POST', path, data=data)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def measure(main, label, request_fn, iterations):
+    durations = []
+    reads = writes = 0
+    for i in range(iterations):
+        before = main.db.stats()
+        start = time.perf_counter()
+        response = request_fn(i)
+        durations.append((time.perf_counter() - start) * 1000)
+        after = main.db.stats()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{label} answered {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        reads += after['reads'] - before['reads']
+        writes += after['writes'] - before['writes']
+    durations.sort()
+    return {'route': label, 'n': iterations, 'mean': sum(durations) / iterations, 'p50': percentile(durations, 0.5),
+            'p95': percentile(durations, 0.95), 'max': durations[-1], 'reads': reads / iterations, 'writes': writes / iterations}
+
+
+def main_benchmark():
+    args = parse_args()
+    configure_environment(args)
+    import main
+
+    rng = random.Random(args.seed)
+    repo = main.get_repository(main.get_pool(main.app_id))
+    started = time.perf_counter()
+    matchups = seed_pool(repo, args.managers, args.matchups, args.decided, rng)
+    if args.pick_storage == 'sheets':
+        from migrations import migrate_pick_sheets
+        migrate_pick_sheets(repo, delete_legacy=True)
+    print(f"Seeded {args.managers} managers x {args.matchups} matchups ({args.decided} decided) "
+          f"into the '{args.datastore}' datastore ({args.pick_storage}) in {time.perf_counter() - started:.1f}s.")
+    print(f"Datastore latency {args.latency_ms:g} ms per call, parallel reads {args.parallel_reads}, {args.server} server.")
+
+    if args.server == 'asgi':
+        import asgi
+        client = AsgiClient(asgi.create_app())
+    else:
+        client = main.app.test_client()
+    client.get('/standings')  # materializes the first snapshot
+
+    # The last decided matchup flips winner on every admin POST, so each one is a real one-matchup change.
+    flipped = matchups[args.decided - 1] if args.decided else matchups[0]
+    def post_admin(i):
+        winner_team_id = flipped['team2Id'] if i % 2 == 0 else flipped['team1Id']
+        return client.post('/admin', data={'matchup_id': flipped['id'], f"winner_matchup_{flipped['id']}": winner_team_id})
+
+    # save_pick swaps the points of the last two (unlocked) matchups on a different manager each time.
+    # The forms are built up front so their reads are not counted against the route.
+    open_matchups = matchups[-2:]
+    save_pick_forms = []
+    for i in range(args.iterations):
+        manager_id = f'manager-{i % args.managers:05d}'
+        picks = {pick['matchupId']: pick for pick in repo.list_manager_picks(manager_id)}
+        form = {'action': 'save_pick', 'matchup_id': [m['id'] for m in open_matchups], 'tie_breaker_score': str(40 + i)}
+        for matchup, other in zip(open_matchups, reversed(open_matchups)):
+            form[f"pick_matchup_{matchup['id']}"] = picks[matchup['id']]['pickedTeamId']
+            form[f"points_matchup_{matchup['id']}"] = str(picks[other['id']]['points'])
+        save_pick_forms.append((manager_id, form))
+    def post_save_pick(i):
+        manager_id, form = save_pick_forms[i]
+        return client.post(f'/user/manager/{manager_id}', data=form)
+
+    main.db.reset_stats()
+    standings_etag = None
+    scenarios = [
+        ('GET /standings', lambda i: client.get('/standings')),
+        ('GET /standings (304)', lambda i: client.get('/standings', headers={'If-None-Match': standings_etag})),
+        ('GET /projections', lambda i: client.get('/projections')),
+        ('GET manager sheet', lambda i: client.get(f'/user/manager/manager-{i % args.managers:05d}')),
+        ('POST /admin', post_admin),
+        ('POST save_pick', post_save_pick),
+    ]
+    results = []
+    for label, request_fn in scenarios:
+        if label == 'GET /standings (304)':
+            standings_etag = client.get('/standings').headers.get('ETag')
+        results.append(measure(main, label, request_fn, args.iterations))
+
+    print(f"\n{'route':<22}{'n':>5}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'reads/req':>11}{'writes/req':>12}")
+    for r in results:
+        print(f"{r['route']:<22}{r['n']:>5}{r['mean']:>10.1f}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['max']:>10.1f}{r['reads']:>11.1f}{r['writes']:>12.1f}")
+    print(f"\nCache: {main.collection_cache.stats()}")
+    if args.server == 'asgi':
+        client.close()
+
+
+if __name__ == '__main__':
+    main_benchmark()
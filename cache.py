@@ -0,0 +1,115 @@
+# cache.py
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 30
+
+
+class CollectionCache:
+    """
+    In-process read-through cache for Firestore collection reads.
+
+    Entries are keyed by collection path (optionally with a query suffix such as
+    "<path>?managerId=<id>") and expire after ttl_seconds. Every write path must call
+    invalidate() for the collections it touches. Cached values are shared between
+    requests, so callers must treat them as read-only.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}
+        self._watches = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, fresh=False):
+        """
+        Returns the cached value for key, calling loader() on a miss, an expired entry or
+        when fresh=True (used by write paths that must not act on stale data).
+        """
+        now = time.monotonic()
+        found, value = self._lookup(key, fresh, now)
+        if not found:
+            value = loader()
+            self._store(key, value, now)
+        return value
+
+    async def get_async(self, key, loader, fresh=False):
+        """get() for a coroutine function loader, awaited on a miss (see asyncreads.py)."""
+        now = time.monotonic()
+        found, value = self._lookup(key, fresh, now)
+        if not found:
+            value = await loader()
+            self._store(key, value, now)
+        return value
+
+    def _lookup(self, key, fresh, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not fresh and (entry[0] is None or entry[0] > now):
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def _store(self, key, value, now):
+        with self._lock:
+            # Collections kept current by a snapshot listener never expire.
+            expires_at = None if self._collection_of(key) in self._watches else now + self.ttl_seconds
+            self._entries[key] = (expires_at, value)
+
+    def invalidate(self, *collection_paths):
+        """Drops the entries for each collection path along with any query keys derived from it."""
+        with self._lock:
+            for key in list(self._entries):
+                if self._collection_of(key) in collection_paths:
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def watch(self, collection_path, query, transform=None):
+        """
+        Keeps collection_path coherent across processes with a Firestore on_snapshot listener:
+        every snapshot replaces the base entry and drops derived query keys. transform(docs)
+        converts the snapshot documents into the cached value (defaults to a list of dicts).
+        """
+        if collection_path in self._watches:
+            return
+
+        def on_snapshot(docs, changes, read_time):
+            value = transform(docs) if transform else [doc.to_dict() for doc in docs]
+            with self._lock:
+                for key in list(self._entries):
+                    if key != collection_path and self._collection_of(key) == collection_path:
+                        del self._entries[key]
+                self._entries[collection_path] = (None, value)
+                self.invalidations += 1
+
+        self._watches[collection_path] = query.on_snapshot(on_snapshot)
+
+    def unwatch_all(self):
+        for watch in self._watches.values():
+            watch.unsubscribe()
+        self._watches.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'ttlSeconds': self.ttl_seconds,
+                'watchedCollections': sorted(self._watches),
+            }
+
+    @staticmethod
+    def _collection_of(key):
+        return key.split('?', 1)[0]
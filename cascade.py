@@ -0,0 +1,163 @@
+# cascade.py
+import threading
+import uuid
+
+from firebase_admin import firestore
+
+# Picks deleted per batch. A decided matchup can also add one manager update per pick,
+# so this stays at half of Firestore's batch limit (batches.MAX_BATCH_WRITES).
+PAGE_SIZE = 250
+# Deletes touching more picks than this run on a background thread.
+ASYNC_THRESHOLD = 1000
+
+# task_id -> progress dict, for deletes running in the background in this process.
+_tasks = {}
+_tasks_lock = threading.Lock()
+
+
+class CascadeProgress(dict):
+    """Progress dict of a background delete; on_update(copy) is called on every change."""
+
+    def __init__(self, on_update=None, **fields):
+        super().__init__(**fields)
+        self.on_update = on_update
+
+    def update_fields(self, **fields):
+        self.update(fields)
+        self.notify()
+
+    def notify(self):
+        if self.on_update:
+            try:
+                self.on_update(dict(self))
+            except Exception as e:
+                print(f"--- ERROR persisting progress of cascade delete {self['id']}: {e} ---")
+
+
+def _add_deleted(progress, num_picks):
+    if progress is not None:
+        progress['deletedPicks'] += num_picks
+        if isinstance(progress, CascadeProgress):
+            progress.notify()
+
+
+def count_related_picks(picks_ref, field, value):
+    """Number of picks whose field equals value, via an aggregation query (billed per 1,000 index entries, not per pick)."""
+    result = picks_ref.where(field, '==', value).count().get()
+    return int(result[0][0].value)
+
+
+def _delete_picks_in_pages(db, managers_ref, picks_ref, field, value, winner_team_id=None, progress=None, scored_manager_ids=()):
+    """
+    Deletes every pick whose field equals value, one page per batch. When winner_team_id is
+    set (a decided matchup), managers who picked the winner lose those points in the same batch,
+    except scored_manager_ids, whose points were already taken back from their pick sheet.
+    """
+    query = picks_ref.where(field, '==', value).limit(PAGE_SIZE)
+    while True:
+        # Deleted picks drop out of the query, so the first page is always the next one.
+        page = list(query.stream())
+        if not page:
+            break
+        batch = db.batch()
+        score_deltas = {}
+        for pick_doc in page:
+            batch.delete(pick_doc.reference)
+            pick = pick_doc.to_dict()
+            if (winner_team_id is not None and pick.get('pickedTeamId') == winner_team_id and pick.get('points')
+                    and pick['managerId'] not in scored_manager_ids):
+                score_deltas[pick['managerId']] = score_deltas.get(pick['managerId'], 0) - pick['points']
+        _add_score_deltas(db, batch, managers_ref, score_deltas)
+        batch.commit()
+        _add_deleted(progress, len(page))
+
+
+def _add_score_deltas(db, batch, managers_ref, score_deltas):
+    if score_deltas:
+        # Only adjust managers that still exist; an update on a missing document would fail the batch.
+        manager_refs = [managers_ref.document(manager_id) for manager_id in score_deltas]
+        for manager_doc in db.get_all(manager_refs):
+            if manager_doc.exists:
+                batch.update(manager_doc.reference, {'totalScore': firestore.Increment(score_deltas[manager_doc.id])})
+
+
+def remove_matchup_from_sheets(db, managers_ref, sheets_ref, matchup_id, winner_team_id=None, progress=None):
+    """
+    Drops a matchup from every pick sheet document that has it, PAGE_SIZE sheets per batch,
+    taking back the points of managers who picked winner_team_id. Returns the ids of every
+    manager that has a sheet (their per-pick documents must not be scored again).
+    """
+    sheet_docs = list(sheets_ref.stream())
+    affected = [doc for doc in sheet_docs if matchup_id in (doc.to_dict().get('picks') or {})]
+    for start in range(0, len(affected), PAGE_SIZE):
+        batch = db.batch()
+        score_deltas = {}
+        for sheet_doc in affected[start:start + PAGE_SIZE]:
+            sheet = sheet_doc.to_dict()
+            pick = sheet['picks'].pop(matchup_id)
+            batch.set(sheet_doc.reference, sheet)
+            if winner_team_id is not None and pick.get('pickedTeamId') == winner_team_id and pick.get('points'):
+                score_deltas[sheet['managerId']] = score_deltas.get(sheet['managerId'], 0) - pick['points']
+        _add_score_deltas(db, batch, managers_ref, score_deltas)
+        batch.commit()
+        _add_deleted(progress, len(affected[start:start + PAGE_SIZE]))
+    return {doc.id for doc in sheet_docs}
+
+
+def delete_manager_cascade(db, managers_ref, picks_ref, manager_id, progress=None, sheets_ref=None):
+    """Deletes a manager's pick sheet (with sheets_ref) and picks in batches, then the manager itself."""
+    if sheets_ref is not None:
+        sheets_ref.document(manager_id).delete()
+    _delete_picks_in_pages(db, managers_ref, picks_ref, 'managerId', manager_id, progress=progress)
+    managers_ref.document(manager_id).delete()
+
+
+def delete_matchup_cascade(db, managers_ref, matchups_ref, picks_ref, matchup_id, progress=None, sheets_ref=None):
+    """
+    Deletes a matchup's picks in batches, taking back the points already awarded if the
+    matchup was decided, then deletes the matchup itself (last, so an interrupted delete can be retried).
+    With sheets_ref (pick sheet storage) the matchup is removed from the sheets first.
+    """
+    matchup_doc = matchups_ref.document(matchup_id).get()
+    winner_team_id = matchup_doc.get('winnerTeamId') if matchup_doc.exists else None
+    scored_manager_ids = ()
+    if sheets_ref is not None:
+        scored_manager_ids = remove_matchup_from_sheets(db, managers_ref, sheets_ref, matchup_id, winner_team_id, progress)
+    _delete_picks_in_pages(db, managers_ref, picks_ref, 'matchupId', matchup_id, winner_team_id=winner_team_id, progress=progress,
+                           scored_manager_ids=scored_manager_ids)
+    matchups_ref.document(matchup_id).delete()
+
+
+def run_cascade_delete(kind, target_id, total_picks, delete_fn, on_complete=None, on_update=None):
+    """
+    Runs delete_fn(progress) on a background thread and returns a task id whose progress
+    can be read with get_cascade_progress() in this process. on_complete() runs after a
+    successful delete; on_update(progress) is called on every change (to persist it), like
+    JobRunner's on_update.
+    """
+    task_id = str(uuid.uuid4())
+    progress = CascadeProgress(on_update, id=task_id, kind=kind, targetId=target_id, status='running',
+                               totalPicks=total_picks, deletedPicks=0, error=None)
+    with _tasks_lock:
+        _tasks[task_id] = progress
+    # Persisted before the redirect, so the status page answers on any worker.
+    progress.notify()
+
+    def worker():
+        try:
+            delete_fn(progress)
+            if on_complete:
+                on_complete()
+            progress.update_fields(status='done')
+        except Exception as e:
+            print(f"--- ERROR during cascade delete of {kind} {target_id}: {e} ---")
+            progress.update_fields(status='failed', error=str(e))
+
+    threading.Thread(target=worker, name=f"cascade-delete-{task_id}", daemon=True).start()
+    return task_id
+
+
+def get_cascade_progress(task_id):
+    with _tasks_lock:
+        progress = _tasks.get(task_id)
+        return dict(progress) if progress else None
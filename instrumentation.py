@@ -0,0 +1,353 @@
+# instrumentation.py
+"""
+Counts Firestore document reads/writes and RPC latency, per request and per route.
+
+instrument_client() wraps the Firestore client (or a LocalClient) in thin proxies; every
+collection, query, document reference and batch handed out by it records what it costs.
+Counters live in this process only, so with several gunicorn workers each one reports its own.
+"""
+import bisect
+from contextvars import ContextVar
+import threading
+import time
+
+# Latency buckets (seconds) for requests and Firestore RPCs.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Work done outside a request (background jobs, cascade deletes) is reported under this route.
+BACKGROUND_ROUTE = 'background'
+
+_current_request = ContextVar('firestore_request_stats', default=None)
+
+
+class RequestStats:
+    """Firestore usage of one request."""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.reads = 0
+        self.writes = 0
+        self.rpcs = 0
+        self.rpc_seconds = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+
+class Metrics:
+    """Process-wide counters, rendered in the Prometheus text format by render()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.request_duration = Histogram()
+        self.reads = {}
+        self.writes = {}
+        self.rpc_duration = Histogram()
+
+    def record_rpc(self, operation, seconds, reads=0, writes=0):
+        stats = _current_request.get()
+        route = stats.route if stats else BACKGROUND_ROUTE
+        with self._lock:
+            self.rpc_duration.observe((('operation', operation),), seconds)
+            if reads:
+                self.reads[route] = self.reads.get(route, 0) + reads
+            if writes:
+                self.writes[route] = self.writes.get(route, 0) + writes
+            # Under the lock too: concurrent reads (see parallelreads.py and asyncreads.py) update one request's stats from several threads.
+            if stats:
+                stats.rpcs += 1
+                stats.rpc_seconds += seconds
+                stats.reads += reads
+                stats.writes += writes
+
+    def record_request(self, stats, method, status):
+        labels = (('route', stats.route), ('method', method), ('status', str(status)))
+        with self._lock:
+            self.requests[labels] = self.requests.get(labels, 0) + 1
+            self.request_duration.observe((('route', stats.route), ('method', method)), stats.elapsed())
+
+    def render(self, extra_metrics=()):
+        """extra_metrics: (name, type, help, value) tuples for other process-wide numbers."""
+        lines = []
+        with self._lock:
+            _render_counter(lines, 'pickem_http_requests_total', 'Requests handled, by route, method and status.', self.requests)
+            _render_histogram(lines, 'pickem_http_request_duration_seconds', 'Request latency.', self.request_duration)
+            _render_counter(lines, 'pickem_firestore_reads_total', 'Firestore documents read, by route.',
+                            {(('route', route),): value for route, value in self.reads.items()})
+            _render_counter(lines, 'pickem_firestore_writes_total', 'Firestore documents written, by route.',
+                            {(('route', route),): value for route, value in self.writes.items()})
+            _render_histogram(lines, 'pickem_firestore_rpc_duration_seconds', 'Firestore RPC latency, by operation.', self.rpc_duration)
+        for name, metric_type, help_text, value in extra_metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _render_counter(lines, name, help_text, series):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    for labels, value in sorted(series.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+
+def _render_histogram(lines, name, help_text, histogram):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, (counts, total, count) in sorted(histogram.series.items()):
+        cumulative = 0
+        for bucket, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bucket)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+
+metrics = Metrics()
+
+
+def start_request(route):
+    stats = RequestStats(route)
+    _current_request.set(stats)
+    return stats
+
+
+def current_request_stats():
+    return _current_request.get()
+
+
+def end_request():
+    _current_request.set(None)
+
+
+# --- Client proxies ---
+
+def _unwrap(value):
+    return value._target if isinstance(value, _Proxy) else value
+
+
+class _Proxy:
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def _timed(self, operation, call, reads=0, writes=0):
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            metrics.record_rpc(operation, time.perf_counter() - started, reads=reads, writes=writes)
+
+
+class QueryProxy(_Proxy):
+    """Collection reference or query."""
+
+    def _chain(self, name, *args, **kwargs):
+        return QueryProxy(getattr(self._target, name)(*args, **kwargs))
+
+    def where(self, *args, **kwargs): return self._chain('where', *args, **kwargs)
+    def order_by(self, *args, **kwargs): return self._chain('order_by', *args, **kwargs)
+    def limit(self, *args, **kwargs): return self._chain('limit', *args, **kwargs)
+    def offset(self, *args, **kwargs): return self._chain('offset', *args, **kwargs)
+    def select(self, *args, **kwargs): return self._chain('select', *args, **kwargs)
+    def start_at(self, *args, **kwargs): return self._chain('start_at', *args, **kwargs)
+    def start_after(self, *args, **kwargs): return self._chain('start_after', *args, **kwargs)
+    def end_at(self, *args, **kwargs): return self._chain('end_at', *args, **kwargs)
+    def end_before(self, *args, **kwargs): return self._chain('end_before', *args, **kwargs)
+
+    def document(self, *args, **kwargs):
+        return DocumentProxy(self._target.document(*args, **kwargs))
+
+    def count(self, *args, **kwargs):
+        return AggregationProxy(self._target.count(*args, **kwargs))
+
+    def stream(self, *args, **kwargs):
+        """Counts documents as they arrive; the RPC is timed until the stream is exhausted."""
+        started = time.perf_counter()
+        num_docs = 0
+        try:
+            for doc in self._target.stream(*args, **kwargs):
+                num_docs += 1
+                yield doc
+        finally:
+            # A query is billed at least one read even when it matches nothing.
+            metrics.record_rpc('stream', time.perf_counter() - started, reads=max(num_docs, 1))
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+    def add(self, document_data, *args, **kwargs):
+        return self._timed('add', lambda: self._target.add(document_data, *args, **kwargs), writes=1)
+
+
+class DocumentProxy(_Proxy):
+    def get(self, *args, **kwargs):
+        return self._timed('get', lambda: self._target.get(*args, **kwargs), reads=1)
+
+    def set(self, *args, **kwargs):
+        return self._timed('set', lambda: self._target.set(*args, **kwargs), writes=1)
+
+    def create(self, *args, **kwargs):
+        return self._timed('create', lambda: self._target.create(*args, **kwargs), writes=1)
+
+    def update(self, *args, **kwargs):
+        return self._timed('update', lambda: self._target.update(*args, **kwargs), writes=1)
+
+    def delete(self, *args, **kwargs):
+        return self._timed('delete', lambda: self._target.delete(*args, **kwargs), writes=1)
+
+    def collection(self, *args, **kwargs):
+        return QueryProxy(self._target.collection(*args, **kwargs))
+
+
+class AggregationProxy(_Proxy):
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._target.get(*args, **kwargs)
+        # Aggregations are billed one read per 1,000 index entries counted.
+        counted = sum(int(aggregate.value) for row in result for aggregate in row)
+        metrics.record_rpc('count', time.perf_counter() - started, reads=max(1, -(-counted // 1000)))
+        return result
+
+
+class BatchProxy(_Proxy):
+    def __init__(self, target):
+        super().__init__(target)
+        self._num_writes = 0
+
+    def create(self, reference, *args, **kwargs):
+        self._num_writes += 1
+        return self._target.create(_unwrap(reference), *args, **kwargs)
+
+    def set(self, reference, *args, **kwargs):
+        self._num_writes += 1
+        return self._target.set(_unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        self._num_writes += 1
+        return self._target.update(_unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        self._num_writes += 1
+        return self._target.delete(_unwrap(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        num_writes, self._num_writes = self._num_writes, 0
+        return self._timed('commit', lambda: self._target.commit(*args, **kwargs), writes=num_writes)
+
+
+class TransactionProxy(BatchProxy):
+    """
+    Counts a transaction's writes like a batch's. The transactional decorator drives it through
+    the transaction's private methods, which are forwarded; the commit is timed like a batch's.
+    """
+
+    def _clean_up(self):
+        # Called before every attempt, so writes of an aborted attempt are not counted twice.
+        self._num_writes = 0
+        return self._target._clean_up()
+
+    def _commit(self):
+        num_writes, self._num_writes = self._num_writes, 0
+        return self._timed('commit', self._target._commit, writes=num_writes)
+
+
+class ClientProxy(_Proxy):
+    """Instrumented client."""
+
+    def collection(self, *args, **kwargs):
+        return QueryProxy(self._target.collection(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return DocumentProxy(self._target.document(*args, **kwargs))
+
+    def batch(self):
+        return BatchProxy(self._target.batch())
+
+    def transaction(self, *args, **kwargs):
+        return TransactionProxy(self._target.transaction(*args, **kwargs))
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        return self._timed('get_all', lambda: list(self._target.get_all(references, *args, **kwargs)), reads=len(references))
+
+
+def instrument_client(client):
+    return ClientProxy(client)
+
+
+# --- Async client proxies (Firestore's AsyncClient, used for reads only; see asyncreads.py) ---
+
+class AsyncQueryProxy(_Proxy):
+    def _chain(self, name, *args, **kwargs):
+        return AsyncQueryProxy(getattr(self._target, name)(*args, **kwargs))
+
+    def where(self, *args, **kwargs): return self._chain('where', *args, **kwargs)
+    def order_by(self, *args, **kwargs): return self._chain('order_by', *args, **kwargs)
+    def limit(self, *args, **kwargs): return self._chain('limit', *args, **kwargs)
+    def select(self, *args, **kwargs): return self._chain('select', *args, **kwargs)
+    def start_after(self, *args, **kwargs): return self._chain('start_after', *args, **kwargs)
+
+    def document(self, *args, **kwargs):
+        return AsyncDocumentProxy(self._target.document(*args, **kwargs))
+
+    async def stream(self, *args, **kwargs):
+        started = time.perf_counter()
+        num_docs = 0
+        try:
+            async for doc in self._target.stream(*args, **kwargs):
+                num_docs += 1
+                yield doc
+        finally:
+            metrics.record_rpc('stream', time.perf_counter() - started, reads=max(num_docs, 1))
+
+    async def get(self, *args, **kwargs):
+        return [doc async for doc in self.stream(*args, **kwargs)]
+
+
+class AsyncDocumentProxy(_Proxy):
+    async def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._target.get(*args, **kwargs)
+        finally:
+            metrics.record_rpc('get', time.perf_counter() - started, reads=1)
+
+    def collection(self, *args, **kwargs):
+        return AsyncQueryProxy(self._target.collection(*args, **kwargs))
+
+
+class AsyncClientProxy(_Proxy):
+    """Instrumented async client. Its RPCs run on the worker's event loop but are counted against the request that gathered them."""
+
+    def collection(self, *args, **kwargs):
+        return AsyncQueryProxy(self._target.collection(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return AsyncDocumentProxy(self._target.document(*args, **kwargs))
+
+
+def instrument_async_client(client):
+    return AsyncClientProxy(client)
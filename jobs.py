@@ -0,0 +1,129 @@
+# jobs.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import threading
+
+# Heavy work (NumPy simulations, full score rebuilds) mostly runs outside the GIL or waits on
+# Firestore, so a small thread pool per worker is enough and shares the worker's Firestore client.
+DEFAULT_MAX_WORKERS = 2
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _new_job(kind, scope, context, previous=None):
+    """Status of a newly queued job; the previous run's result stays visible until this one finishes."""
+    return {
+        'id': f"{kind}:{scope}", 'kind': kind, 'scope': scope, 'status': 'queued', 'context': context or {},
+        'submittedAt': _now(), 'startedAt': None, 'finishedAt': None, 'runs': 0, 'coalesced': 0,
+        'rerunRequested': False, 'result': previous['result'] if previous else None, 'error': None,
+    }
+
+
+class JobRunner:
+    """
+    Runs background jobs keyed by (kind, scope), e.g. ('snapshot', pool key). At most one job
+    per key is queued or running: a trigger that arrives while one is queued is merged into
+    it, and one that arrives while it runs makes it run once more afterwards, so any number of
+    triggers costs at most one extra run. on_update(status) is called on every state change,
+    which is how the latest status and result get persisted.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, on_update=None):
+        self.max_workers = max_workers
+        self.on_update = on_update
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._jobs = {}
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so that no threads exist before gunicorn forks its workers.
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        return self._executor
+
+    def submit(self, kind, scope, fn, context=None):
+        """
+        Schedules fn() (its return value becomes the job's result) unless an equivalent job is
+        already pending. context is stored with the status, e.g. the pool it belongs to.
+        Returns the job's status.
+        """
+        key = (kind, scope)
+        with self._lock:
+            self._functions[key] = fn
+            job = self._jobs.get(key)
+            if job and job['status'] in ACTIVE_STATUSES:
+                job['coalesced'] += 1
+                if job['status'] == 'running':
+                    job['rerunRequested'] = True
+                return dict(job)
+            job = self._jobs[key] = _new_job(kind, scope, context, job)
+            status = dict(job)
+        self._notify(status)
+        self._get_executor().submit(self._run, key)
+        return status
+
+    def run_now(self, kind, scope, fn, context=None):
+        """Runs fn() in the calling thread, recording it like a background job. Returns the status."""
+        key = (kind, scope)
+        with self._lock:
+            self._functions[key] = fn
+            previous = self._jobs.get(key)
+            if previous and previous['status'] in ACTIVE_STATUSES:
+                previous['rerunRequested'] = True
+                previous['coalesced'] += 1
+                return dict(previous)
+            self._jobs[key] = _new_job(kind, scope, context, previous)
+        self._run(key)
+        return self.get(kind, scope)
+
+    def _run(self, key):
+        while True:
+            with self._lock:
+                job = self._jobs[key]
+                fn = self._functions[key]
+                job.update(status='running', startedAt=_now(), rerunRequested=False)
+                job['runs'] += 1
+                status = dict(job)
+            self._notify(status)
+
+            try:
+                result, error = fn(), None
+            except Exception as e:
+                print(f"--- ERROR in background job {job['id']}: {e} ---")
+                result, error = None, str(e)
+
+            with self._lock:
+                rerun = job['rerunRequested']
+                if error is None:
+                    job['result'] = result
+                job.update(status='queued' if rerun else ('failed' if error else 'done'), error=error,
+                           finishedAt=None if rerun else _now())
+                status = dict(job)
+            if not rerun:
+                self._notify(status)
+                return
+
+    def _notify(self, status):
+        if self.on_update:
+            try:
+                self.on_update(status)
+            except Exception as e:
+                print(f"--- ERROR persisting status of job {status['id']}: {e} ---")
+
+    def get(self, kind, scope):
+        """This process's status for the job, or None if it never ran here."""
+        with self._lock:
+            job = self._jobs.get((kind, scope))
+            return dict(job) if job else None
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,26 @@
+# live_gunicorn.conf.py
+"""
+Gunicorn settings for the 'live' process, which serves the /live event streams:
+
+    gunicorn --config live_gunicorn.conf.py "main:create_app()"
+
+gevent workers park each open stream on a greenlet instead of a thread, so one worker holds
+thousands of viewers. Route /live to this process at the load balancer and everything else to
+the web process. It needs SNAPSHOT_STORE=firestore, since it only learns about new snapshots
+through the snapshot document's listener.
+"""
+import os
+
+bind = f":{os.environ.get('PORT', '8080')}"
+worker_class = 'gevent'
+workers = int(os.environ.get('LIVE_WORKERS', 1))
+worker_connections = int(os.environ.get('LIVE_WORKER_CONNECTIONS', 5000))
+# Streams end on their own after LIVE_STREAM_SECONDS; keep some connections for the rest.
+raw_env = [f"LIVE_MAX_STREAMS={worker_connections - 100}"]
+
+
+def post_worker_init(worker):
+    # The worker has patched the standard library by now; gRPC (the Firestore listener) must be
+    # told to cooperate with gevent before the lazily created client opens its first channel.
+    from grpc.experimental import gevent as grpc_gevent
+    grpc_gevent.init_gevent()
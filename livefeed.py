@@ -0,0 +1,167 @@
+# livefeed.py
+"""
+Live standings/projections for Server-Sent Events.
+
+Each worker keeps one ChangeFeed per pool, fed by a single source (a snapshot listener, or
+publish() from the worker that materialized the snapshot). Every open event stream in the
+worker waits on that feed, so a new snapshot costs one read per worker, not one per viewer,
+and the delta between two versions is computed once and sent to everyone.
+"""
+from collections import deque
+import json
+import threading
+import time
+
+# Deltas kept per feed; a viewer further behind than this gets the full snapshot instead.
+HISTORY_LENGTH = 32
+# Comment line sent while nothing changes, so proxies keep the connection open.
+KEEPALIVE_SECONDS = 15
+# Milliseconds EventSource waits before reconnecting (it resumes from the last event id).
+RECONNECT_MS = 3000
+# Seconds a viewer turned away by StreamLimit is told to wait before trying again.
+RETRY_AFTER_SECONDS = 60
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def live_view(snapshot):
+    """The part of a snapshot that the live pages show."""
+    return {
+        'version': snapshot['version'],
+        'generatedAt': snapshot['generatedAt'],
+        'standings': snapshot['standings'],
+        'projections': snapshot['projections'],
+        'projectionInfo': snapshot['projectionInfo'],
+    }
+
+
+def diff_rows(old_rows, new_rows):
+    """{order, changed, removed} turning old_rows into new_rows; rows are matched by 'id'."""
+    old_by_id = {row['id']: row for row in old_rows}
+    new_ids = {row['id'] for row in new_rows}
+    return {
+        'order': [row['id'] for row in new_rows],
+        'changed': [row for row in new_rows if old_by_id.get(row['id']) != row],
+        'removed': [row_id for row_id in old_by_id if row_id not in new_ids],
+    }
+
+
+def diff_views(old, new):
+    return {
+        'version': new['version'],
+        'previousVersion': old['version'],
+        'generatedAt': new['generatedAt'],
+        'standings': diff_rows(old['standings'], new['standings']),
+        'projections': diff_rows(old['projections'], new['projections']),
+        'projectionInfo': new['projectionInfo'],
+    }
+
+
+def format_event(event_name, payload):
+    return f"id: {payload['version']}\nevent: {event_name}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+class ChangeFeed:
+    """Latest view of one pool plus the recent deltas, shared by every stream in the worker."""
+
+    def __init__(self):
+        self.current = None
+        self.listener = None
+        self._deltas = deque(maxlen=HISTORY_LENGTH)
+        self._condition = threading.Condition()
+
+    def publish(self, snapshot):
+        """Records a snapshot if it is newer than the current one and wakes every waiting stream."""
+        if not snapshot:
+            return False
+        view = live_view(snapshot)
+        with self._condition:
+            if self.current is not None and view['version'] <= self.current['version']:
+                return False
+            if self.current is not None:
+                self._deltas.append(diff_views(self.current, view))
+            self.current = view
+            self._condition.notify_all()
+        return True
+
+    def events_since(self, version):
+        """[(event name, payload)] bringing a viewer at version up to date ([] if it already is)."""
+        with self._condition:
+            current = self.current
+            if current is None or current['version'] == version:
+                return []
+            deltas = [delta for delta in self._deltas if version is not None and delta['previousVersion'] >= version]
+            if deltas and deltas[0]['previousVersion'] == version:
+                return [('update', delta) for delta in deltas]
+            return [('snapshot', current)]
+
+    def wait(self, version, timeout):
+        """Blocks until there is a version other than version (or timeout), then returns events_since(version)."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.current is not None and self.current['version'] != version, timeout)
+        return self.events_since(version)
+
+    def stream(self, since, max_seconds):
+        """
+        Server-Sent Events for a viewer whose page shows version since (None for nothing yet).
+        Ends after max_seconds; the browser then reconnects and resumes from the last event id.
+        """
+        yield f"retry: {RECONNECT_MS}\n\n"
+        deadline = time.monotonic() + max_seconds
+        version = since
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events = self.wait(version, min(KEEPALIVE_SECONDS, remaining))
+            if not events:
+                yield ": keepalive\n\n"
+            for event_name, payload in events:
+                yield format_event(event_name, payload)
+                version = payload['version']
+
+
+class StreamLimit:
+    """
+    Caps the event streams open in one worker. Under a threaded worker every open stream holds
+    a thread, so without a cap the viewers would take every thread and starve all other routes.
+    """
+
+    def __init__(self, max_streams):
+        self.max_streams = max_streams
+        self.open_streams = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.open_streams >= self.max_streams:
+                return False
+            self.open_streams += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open_streams -= 1
+
+
+def get_feed(key, start=None):
+    """The worker's feed for key, created (and start(feed) called) on first use."""
+    feed = _feeds.get(key)
+    if feed is not None:
+        return feed
+    with _feeds_lock:
+        feed = _feeds.get(key)
+        if feed is None:
+            feed = ChangeFeed()
+            if start:
+                start(feed)
+            _feeds[key] = feed
+    return feed
+
+
+def publish(key, snapshot):
+    """Hands a snapshot this worker just made to the feed for key, if anyone here is watching it."""
+    feed = _feeds.get(key)
+    if feed is not None:
+        feed.publish(snapshot)
@@ -0,0 +1,595 @@
+# localstore.py
+"""
+A local stand-in for the Firestore client, backed by SQLite (a file, or ':memory:').
+
+It implements the part of the Firestore API this app uses (collections, documents, where /
+order_by / limit / start_after queries, count(), batches, transactions, get_all, Increment
+and DELETE_FIELD transforms, on_snapshot within the process), so the app and its scoring,
+ordering and cascade code run unchanged without a Firebase project. Reads and writes are
+counted the way Firestore bills them, which makes it useful for load tests and profiling.
+latency_seconds adds a simulated network round trip to every read and commit.
+AsyncLocalClient gives the reads the shape of Firestore's AsyncClient, for asyncreads.py.
+"""
+import asyncio
+import copy
+import functools
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import InvalidArgument, NotFound
+from google.cloud.firestore_v1 import transforms
+
+from batches import MAX_BATCH_WRITES
+
+# Fields that can be filtered with an SQLite expression index (plain Firestore field names).
+INDEXABLE_FIELD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: _sort_key(a) < _sort_key(b),
+    '<=': lambda a, b: _sort_key(a) <= _sort_key(b),
+    '>': lambda a, b: _sort_key(a) > _sort_key(b),
+    '>=': lambda a, b: _sort_key(a) >= _sort_key(b),
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a not in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+
+def _sort_key(value):
+    """Firestore orders values by type first (null < booleans < numbers < strings < arrays < maps)."""
+    if value is None: return (0, 0)
+    if isinstance(value, bool): return (1, value)
+    if isinstance(value, (int, float)): return (2, value)
+    if isinstance(value, str): return (3, value)
+    if isinstance(value, list): return (4, [_sort_key(v) for v in value])
+    return (5, json.dumps(value, sort_keys=True))
+
+
+def _sql_value(value):
+    """True for values SQLite's json_extract() compares exactly like Firestore does."""
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def _get_field(data, field_path):
+    """(found, value) for a possibly dotted field path."""
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _apply_transform(current, value):
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc).isoformat()
+    return copy.deepcopy(value)
+
+
+def _set_field(data, field_path, value):
+    parts = field_path.split('.')
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is transforms.DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = _apply_transform(data.get(parts[-1]), value)
+
+
+def _merge(data, updates):
+    for key, value in updates.items():
+        if isinstance(value, dict):
+            if not isinstance(data.get(key), dict):
+                data[key] = {}
+            _merge(data[key], value)
+        elif value is transforms.DELETE_FIELD:
+            data.pop(key, None)
+        else:
+            data[key] = _apply_transform(data.get(key), value)
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        found, value = _get_field(self._data or {}, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class DocumentReference:
+    def __init__(self, client, collection_path, document_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+        self.path = f"{collection_path}/{document_id}"
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._collection_path)
+
+    def collection(self, collection_name):
+        return CollectionReference(self._client, f"{self.path}/{collection_name}")
+
+    def get(self, field_paths=None, transaction=None):
+        return next(iter(self._client.get_all([self], transaction=transaction)))
+
+    def create(self, document_data):
+        self._client._commit([('create', self, document_data)])
+
+    def set(self, document_data, merge=False):
+        self._client._commit([('set_merge' if merge else 'set', self, document_data)])
+
+    def update(self, field_updates):
+        self._client._commit([('update', self, field_updates)])
+
+    def delete(self):
+        self._client._commit([('delete', self, None)])
+
+    def on_snapshot(self, callback):
+        return self.parent.where('__name__', '==', self.id).on_snapshot(
+            lambda docs, changes, read_time: callback(docs or [DocumentSnapshot(self, None)], changes, read_time))
+
+
+class AggregationResult:
+    def __init__(self, alias, value, read_time):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+
+class CountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias or 'field_1'
+
+    def get(self, transaction=None):
+        self._query._client._round_trip()
+        count = len(self._query._matching(count_reads=False))
+        # Billed as one read per batch of up to 1,000 index entries.
+        self._query._client._count_reads(max(1, -(-count // 1000)))
+        return [[AggregationResult(self._alias, count, datetime.now(timezone.utc))]]
+
+
+class Query:
+    def __init__(self, client, collection_path, filters=(), orders=(), limit=None, offset=0, cursor=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit, offset=self._offset, cursor=self._cursor)
+        state.update(changes)
+        return Query(self._client, self._collection_path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPERATORS:
+            raise InvalidArgument(f"Unsupported operator {op_string!r}.")
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def count(self, alias=None):
+        return CountQuery(self, alias)
+
+    def _order_values(self, document_id, data):
+        return [document_id if field_path == '__name__' else _get_field(data, field_path)[1] for field_path, _ in self._orders] + [document_id]
+
+    def _compare(self, values_a, values_b):
+        directions = [direction for _, direction in self._orders]
+        # Ties are broken by document id, in the direction of the last ordering.
+        directions.append(directions[-1] if directions else 'ASCENDING')
+        for a, b, direction in zip(values_a, values_b, directions):
+            key_a, key_b = _sort_key(a), _sort_key(b)
+            if key_a != key_b:
+                result = -1 if key_a < key_b else 1
+                return -result if direction == 'DESCENDING' else result
+        return 0
+
+    def _matching(self, count_reads=True):
+        """[(document_id, data)] matching the query, in query order."""
+        documents = self._client._select(self._collection_path, self._filters)
+        for field_path, op_string, value in self._filters:
+            if field_path == '__name__':
+                value = [getattr(v, 'id', v) for v in value] if op_string in ('in', 'not-in') else getattr(value, 'id', value)
+                documents = [(doc_id, data) for doc_id, data in documents if _OPERATORS[op_string](doc_id, value)]
+                continue
+            matching = []
+            for doc_id, data in documents:
+                found, field_value = _get_field(data, field_path)
+                if found and _OPERATORS[op_string](field_value, value):
+                    matching.append((doc_id, data))
+            documents = matching
+        # Documents without an ordered field are left out, as in Firestore.
+        for field_path, _ in self._orders:
+            if field_path != '__name__':
+                documents = [(doc_id, data) for doc_id, data in documents if _get_field(data, field_path)[0]]
+        documents.sort(key=functools.cmp_to_key(lambda a, b: self._compare(self._order_values(*a), self._order_values(*b))))
+
+        if self._cursor is not None:
+            if isinstance(self._cursor, dict):
+                cursor_values = [self._cursor.get(field_path) for field_path, _ in self._orders]
+                documents = [d for d in documents if self._compare(self._order_values(*d)[:-1], cursor_values) > 0]
+            else:
+                cursor_values = self._order_values(self._cursor.id, self._cursor.to_dict() or {})
+                documents = [d for d in documents if self._compare(self._order_values(*d), cursor_values) > 0]
+        documents = documents[self._offset:]
+        if self._limit is not None:
+            documents = documents[:self._limit]
+        if count_reads:
+            # A query costs at least one read, even when nothing matches.
+            self._client._count_reads(max(1, len(documents)))
+        return documents
+
+    def stream(self, transaction=None):
+        self._client._round_trip()
+        with self._client._lock:
+            documents = self._matching()
+        for doc_id, data in documents:
+            yield DocumentSnapshot(DocumentReference(self._client, self._collection_path, doc_id), data)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        """Calls callback(docs, changes, read_time) now and after every local write to the collection."""
+        return self._client._listen(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, collection_path):
+        super().__init__(client, collection_path)
+        self.id = collection_path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._collection_path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.now(timezone.utc), ref
+
+    def list_documents(self):
+        return [DocumentReference(self._client, self._collection_path, doc_id) for doc_id, _ in self._client._select(self._collection_path, ())]
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set_merge' if merge else 'set', reference, document_data))
+
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference, field_updates))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._client._commit(writes)
+        return []
+
+
+class Transaction(WriteBatch):
+    """Serializes with every other write by holding the store lock from _begin() until commit or rollback."""
+
+    _max_attempts = 1
+    _read_only = False
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        try:
+            writes, self._writes = self._writes, []
+            self._client._commit(writes)
+        finally:
+            self._release()
+        return []
+
+    def _rollback(self):
+        self._writes = []
+        self._release()
+
+    def _release(self):
+        if self._id is not None:
+            self._id = None
+            self._client._lock.release()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return ref_or_query.get(transaction=self)
+        return ref_or_query.stream(transaction=self)
+
+
+class LocalClient:
+    """Firestore-compatible client over one SQLite database. path=':memory:' keeps everything in the process."""
+
+    def __init__(self, path=':memory:', latency_seconds=0):
+        self.path = path
+        self.latency_seconds = latency_seconds
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL" if path != ':memory:' else "PRAGMA journal_mode=MEMORY")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents (collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (collection, id))")
+        self._lock = threading.RLock()
+        self._indexed_fields = set()
+        self._listeners = []
+        self.reads = 0
+        self.writes = 0
+
+    # --- Firestore client API ---
+
+    def collection(self, collection_path):
+        return CollectionReference(self, collection_path)
+
+    def document(self, document_path):
+        collection_path, _, document_id = document_path.rpartition('/')
+        return DocumentReference(self, collection_path, document_id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, max_attempts=1, read_only=False):
+        return Transaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._round_trip()
+        with self._lock:
+            snapshots = [DocumentSnapshot(ref, self._load(ref._collection_path, ref.id)) for ref in references]
+            self._count_reads(len(snapshots))
+        return iter(snapshots)
+
+    def close(self):
+        self._connection.close()
+
+    def _round_trip(self):
+        # Slept outside the lock, so concurrent requests overlap their round trips as they would against Firestore.
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    # --- Read/write counters (what Firestore would bill) ---
+
+    def stats(self):
+        with self._lock:
+            return {'reads': self.reads, 'writes': self.writes}
+
+    def reset_stats(self):
+        with self._lock:
+            self.reads = self.writes = 0
+
+    def _count_reads(self, count):
+        with self._lock:
+            self.reads += count
+
+    # --- Storage ---
+
+    def _load(self, collection_path, document_id):
+        row = self._connection.execute("SELECT data FROM documents WHERE collection = ? AND id = ?", (collection_path, document_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _ensure_index(self, field_path):
+        """Expression index per filtered field, like Firestore's automatic single-field indexes."""
+        if field_path not in self._indexed_fields:
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS documents_{field_path} ON documents (collection, json_extract(data, '$.{field_path}'))")
+            self._indexed_fields.add(field_path)
+
+    def _select(self, collection_path, filters):
+        """
+        Rows of a collection, narrowed in SQL by the first equality/'in' filter on a plain field.
+        The caller still applies every filter, so this only has to return a superset.
+        """
+        sql, params = "SELECT id, data FROM documents WHERE collection = ?", [collection_path]
+        for field_path, op_string, value in filters:
+            if field_path == '__name__':
+                if op_string == '==':
+                    sql += " AND id = ?"
+                    params.append(getattr(value, 'id', value))
+                    break
+                continue
+            if not INDEXABLE_FIELD.match(field_path):
+                continue
+            if op_string == '==' and _sql_value(value):
+                values = [value]
+            elif op_string == 'in' and value and all(_sql_value(v) for v in value):
+                values = list(value)
+            else:
+                continue
+            self._ensure_index(field_path)
+            sql += f" AND json_extract(data, '$.{field_path}') IN ({', '.join('?' * len(values))})"
+            params += values
+            break
+        with self._lock:
+            return [(doc_id, json.loads(data)) for doc_id, data in self._connection.execute(sql, params)]
+
+    def _commit(self, writes):
+        """Applies writes atomically: either all of them are stored or none is."""
+        if len(writes) > MAX_BATCH_WRITES:
+            raise InvalidArgument(f"A batch can contain at most {MAX_BATCH_WRITES} writes ({len(writes)} given).")
+        if not writes:
+            return
+        self._round_trip()
+        with self._lock:
+            pending = {}
+            for kind, ref, document_data in writes:
+                key = (ref._collection_path, ref.id)
+                current = pending[key] if key in pending else self._load(*key)
+                if kind == 'create':
+                    if current is not None:
+                        raise InvalidArgument(f"Document already exists: {ref.path}")
+                    current = {}
+                    _merge(current, document_data)
+                elif kind == 'set':
+                    current = {}
+                    _merge(current, document_data)
+                elif kind == 'set_merge':
+                    current = copy.deepcopy(current) if current is not None else {}
+                    _merge(current, document_data)
+                elif kind == 'update':
+                    if current is None:
+                        raise NotFound(f"No document to update: {ref.path}")
+                    current = copy.deepcopy(current)
+                    for field_path, value in document_data.items():
+                        _set_field(current, field_path, value)
+                else:
+                    current = None
+                pending[key] = current
+
+            self._connection.execute("BEGIN")
+            try:
+                for (collection_path, document_id), data in pending.items():
+                    if data is None:
+                        self._connection.execute("DELETE FROM documents WHERE collection = ? AND id = ?", (collection_path, document_id))
+                    else:
+                        self._connection.execute("INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)",
+                                                 (collection_path, document_id, json.dumps(data)))
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self.writes += len(writes)
+            changed_collections = {collection_path for collection_path, _ in pending}
+        self._notify(changed_collections)
+
+    # --- In-process listeners ---
+
+    def _listen(self, query, callback):
+        listener = (query, callback)
+        with self._lock:
+            self._listeners.append(listener)
+        self._deliver(query, callback)
+        client = self
+
+        class Watch:
+            def unsubscribe(self):
+                with client._lock:
+                    if listener in client._listeners:
+                        client._listeners.remove(listener)
+
+        return Watch()
+
+    def _deliver(self, query, callback):
+        callback(query.get(), [], datetime.now(timezone.utc))
+
+    def _notify(self, collection_paths):
+        with self._lock:
+            listeners = [(query, callback) for query, callback in self._listeners if query._collection_path in collection_paths]
+        for query, callback in listeners:
+            try:
+                self._deliver(query, callback)
+            except Exception as e:
+                print(f"--- ERROR in local snapshot listener for {query._collection_path}: {e} ---")
+
+
+# --- Async reads ---
+
+class AsyncLocalClient:
+    """
+    The read API of Firestore's AsyncClient over a LocalClient (or an instrumented one). SQLite
+    has no async driver, so every read runs on the event loop's default executor; reads gathered
+    together still overlap their round trips, as they would against Firestore.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def collection(self, collection_path):
+        return _AsyncQuery(self._client.collection(collection_path))
+
+    def document(self, document_path):
+        return _AsyncDocument(self._client.document(document_path))
+
+
+class _AsyncQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def where(self, *args, **kwargs): return _AsyncQuery(self._query.where(*args, **kwargs))
+    def order_by(self, *args, **kwargs): return _AsyncQuery(self._query.order_by(*args, **kwargs))
+    def limit(self, *args, **kwargs): return _AsyncQuery(self._query.limit(*args, **kwargs))
+    def start_after(self, *args, **kwargs): return _AsyncQuery(self._query.start_after(*args, **kwargs))
+
+    def document(self, document_id=None):
+        return _AsyncDocument(self._query.document(document_id))
+
+    async def stream(self):
+        for doc in await asyncio.to_thread(self._query.get):
+            yield doc
+
+    async def get(self):
+        return await asyncio.to_thread(self._query.get)
+
+
+class _AsyncDocument:
+    def __init__(self, reference):
+        self._reference = reference
+
+    @property
+    def id(self):
+        return self._reference.id
+
+    def collection(self, collection_name):
+        return _AsyncQuery(self._reference.collection(collection_name))
+
+    async def get(self):
+        return await asyncio.to_thread(self._reference.get)
@@ -1,12 +1,34 @@
 
 # main.py
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import (Flask, render_template, request, redirect, url_for, session, jsonify, make_response, g, has_request_context,
+                   Response, stream_with_context)
+import click
 import firebase_admin
-from firebase_admin import credentials, firestore
-import uuid
-import random
+from firebase_admin import credentials, firestore, firestore_async
+from google.api_core.exceptions import NotFound
 import json
 import os
+from datetime import datetime
+from functools import partial
+
+import asyncreads
+from cache import CollectionCache, DEFAULT_TTL_SECONDS
+from cascade import ASYNC_THRESHOLD, get_cascade_progress, run_cascade_delete
+import instrumentation
+from jobs import ACTIVE_STATUSES, DEFAULT_MAX_WORKERS, JobRunner
+import livefeed
+import parallelreads
+from migrations import MIGRATIONS, migrate_pick_sheets, run_migrations
+from pools import DEFAULT_POOL_ID, get_pool, pool_registry_entry, validate_pool
+from picksheet import PickSheetError, locked_matchup_ids, parse_pick_form, pick_sheet_picks, validate_pick_sheet
+from repository import (DATASTORE_BACKENDS, PICK_STORAGE_FORMATS, AsyncPoolRepository, LazyClient, PoolRepository, create_async_local_client,
+                        create_local_client)
+from scoring import diff_winners
+from simulation import DEFAULT_CI_WIDTH, DEFAULT_MAX_SIMULATIONS, DEFAULT_NUM_SIMULATIONS, build_pick_matrix
+from transfer import (PICK_COLUMNS, RESULT_COLUMNS, UPLOAD_READ_ERRORS, XLSX_MIMETYPE, TransferError, iter_pick_rows, iter_result_rows, iter_upload_rows,
+                      parse_results, stream_csv, stream_xlsx, validate_pick_import)
+from snapshots import FileSnapshotStore, FirestoreSnapshotStore, group_picks_by_manager, materialize_snapshot
+from whatif import WhatIfError, project_what_if, resolve_forced_outcomes
 
 app = Flask(__name__)
 
@@ -35,78 +57,492 @@ def load_secret_key():
 app.secret_key = load_secret_key()
 # ------------------------------------------
 
-# Global Firebase variables, initialized on app startup.
-db = None
+# --- Projection settings (override via environment) ---
+PROJECTION_SIMULATIONS = int(os.environ.get('PROJECTION_SIMULATIONS', DEFAULT_NUM_SIMULATIONS))
+# Set PROJECTION_SEED for reproducible projections; unset draws a fresh seed per request.
+PROJECTION_SEED = int(os.environ['PROJECTION_SEED']) if os.environ.get('PROJECTION_SEED') else None
+# 'auto' enumerates every outcome exactly when that is cheaper than sampling; 'exact' or 'monte_carlo' forces one.
+PROJECTION_METHOD = os.environ.get('PROJECTION_METHOD', 'auto')
+# Monte Carlo keeps simulating until every probability's 95% confidence interval is at most this
+# wide (0.01 = one percentage point), up to PROJECTION_MAX_SIMULATIONS. 0 runs exactly PROJECTION_SIMULATIONS.
+PROJECTION_CI_WIDTH = float(os.environ.get('PROJECTION_CI_WIDTH', DEFAULT_CI_WIDTH))
+PROJECTION_MAX_SIMULATIONS = int(os.environ.get('PROJECTION_MAX_SIMULATIONS', DEFAULT_MAX_SIMULATIONS))
+# Processes the simulation chunks are spread over (defaults to every core).
+PROJECTION_WORKERS = int(os.environ['PROJECTION_WORKERS']) if os.environ.get('PROJECTION_WORKERS') else None
+
+# --- Standings/projections snapshot settings ---
+# 'firestore' keeps the snapshot in one document shared by all instances; 'file' writes SNAPSHOT_FILE locally.
+SNAPSHOT_STORE = os.environ.get('SNAPSHOT_STORE', 'firestore')
+SNAPSHOT_FILE = os.environ.get('SNAPSHOT_FILE', 'snapshots/latest.json')
+# Seconds a live standings stream stays open before the browser reconnects (and resumes).
+LIVE_STREAM_SECONDS = float(os.environ.get('LIVE_STREAM_SECONDS', 300))
+# Live streams each worker keeps open; more viewers get a 503 and fall back to polling. Each one
+# holds a thread of the web process, so keep this well under its --threads (ASGI_THREADS under asgi.py). The gevent 'live'
+# process (live_gunicorn.conf.py) holds streams on greenlets and raises it to thousands.
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 16))
+
+# --- Cache settings ---
+# CACHE_USE_LISTENERS=1 keeps each pool's cached collections coherent with Firestore snapshot listeners.
+CACHE_USE_LISTENERS = os.environ.get('CACHE_USE_LISTENERS') == '1'
+
+# --- Background job settings ---
+# 'background' runs snapshot refreshes and score rebuilds on a thread pool so requests return
+# right away; 'inline' runs them inside the request (simpler to debug, and used by benchmarks).
+JOBS_MODE = os.environ.get('JOBS_MODE', 'background')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', DEFAULT_MAX_WORKERS))
+
+# --- Datastore settings ---
+# 'firestore' needs the service account credentials; 'sqlite' (DATASTORE_FILE) and 'memory'
+# run everything locally, e.g. for load tests and profiling.
+DATASTORE = os.environ.get('DATASTORE', 'firestore')
+DATASTORE_FILE = os.environ.get('DATASTORE_FILE', 'local/pickem.sqlite3')
+# 'documents' stores one document per pick; 'sheets' stores one document per manager's sheet, so
+# a sheet costs one read and standings one read per manager. Move existing pools over with
+# `flask --app main migrate-pick-sheets` after switching; until then old picks are still read.
+PICK_STORAGE = os.environ.get('PICK_STORAGE', 'documents')
+# Milliseconds added to every round trip of a local datastore, to approximate Firestore's network latency.
+DATASTORE_LATENCY_MS = float(os.environ.get('DATASTORE_LATENCY_MS', 0))
+# Pages fetch independent collections in parallel, as coroutines on the worker's event loop under
+# asgi.py and on READ_WORKERS threads under gunicorn; PARALLEL_READS=0 reads them one by one.
+PARALLEL_READS = os.environ.get('PARALLEL_READS', '1') == '1'
+READ_WORKERS = int(os.environ.get('READ_WORKERS', parallelreads.DEFAULT_MAX_WORKERS))
+
+# --- Instrumentation settings ---
+# SERVER_TIMING=1 adds a Server-Timing header (Firestore time, reads/writes, total) to every response.
+SERVER_TIMING = os.environ.get('SERVER_TIMING') == '1'
+# Requests slower than this are logged with their Firestore usage; 0 turns the log off.
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+
+# Global Firebase variables; the client itself (db) is created lazily, see create_datastore_client.
 firebase_app = None
 app_id = None
 
-def get_collection_path(collection_name):
-    if app_id:
-        return f"artifacts/{app_id}/public/data/{collection_name}"
-    return collection_name # Fallback for local testing
-
-# def _backfill_matchup_sort_order(db_client):
-#     """
-#     Finds any matchups that are missing a 'sortOrder' field and assigns them one.
-#     This is a data migration that runs on startup to ensure data integrity.
-#     """
-#     print("Running startup data migration for matchup sortOrder...")
-#     try:
-#         matchups_ref = db_client.collection(get_collection_path('matchups'))
-#         all_docs = list(matchups_ref.stream())
-        
-#         docs_to_update = []
-#         docs_with_order = []
-#         for doc in all_docs:
-#             doc_data = doc.to_dict()
-#             # Check for missing key or if the value is None
-#             if 'sortOrder' not in doc_data or doc_data.get('sortOrder') is None:
-#                 docs_to_update.append(doc)
-#             else:
-#                 docs_with_order.append(doc_data)
-
-#         if docs_to_update:
-#             print(f"Found {len(docs_to_update)} matchups missing sortOrder. Backfilling now...")
-#             next_sort_order = 1
-#             if docs_with_order:
-#                 # Find the max sort order, safely handling None and non-numeric values
-#                 max_order = 0
-#                 for d in docs_with_order:
-#                     order = d.get('sortOrder')
-#                     if isinstance(order, (int, float)):
-#                         if order > max_order:
-#                             max_order = order
-#                 next_sort_order = int(max_order) + 1
-            
-#             batch = db_client.batch()
-#             # Sort by ID for a consistent order before assigning new sort values
-#             docs_to_update.sort(key=lambda d: d.id)
-#             for doc in docs_to_update:
-#                 batch.update(doc.reference, {'sortOrder': next_sort_order})
-#                 next_sort_order += 1
-#             batch.commit()
-#             print("Successfully backfilled sortOrder for all missing matchups.")
-#         else:
-#             print("All matchups have a valid sortOrder. No migration needed.")
-#     except Exception as e:
-#         print(f"--- CRITICAL ERROR during sortOrder backfill migration: {e} ---")
-
-# Function to initialize Firebase Admin SDK.
-
-def initialize_firebase():
-    global db, firebase_app, app_id
+def current_pool():
+    """The pool selected for this request (see select_pool), or the default pool outside of one."""
+    if has_request_context() and 'pool' in g:
+        return g.pool
+    return get_pool(app_id)
+
+def get_collection_path(collection_name, pool=None):
+    return (pool or current_pool()).collection_path(collection_name)
+
+def get_repository(pool=None):
+    """Data access for the current pool (or the given one)."""
+    return PoolRepository(db, pool or current_pool(), pick_storage=PICK_STORAGE)
+
+def get_async_repository(pool=None):
+    """Async reads for the pool, on the worker's event loop (see asyncreads.py)."""
+    return AsyncPoolRepository(async_db, pool or current_pool(), pick_storage=PICK_STORAGE)
+
+# --- Cached collection reads ---
+# Whole-collection reads go through this cache; every write path below invalidates what it touches.
+collection_cache = CollectionCache(ttl_seconds=float(os.environ.get('CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)))
+
+# Each load that pages gather has an async twin with the same arguments, used under asgi.py.
+
+async def load_managers_async(fresh=False, pool=None):
+    return await collection_cache.get_async(get_collection_path('managers', pool), get_async_repository(pool).list_managers, fresh)
+
+@asyncreads.async_version(load_managers_async)
+def load_managers(fresh=False, pool=None):
+    return collection_cache.get(get_collection_path('managers', pool), get_repository(pool).list_managers, fresh)
+
+async def load_matchups_async(fresh=False, pool=None):
+    return await collection_cache.get_async(get_collection_path('matchups', pool), get_async_repository(pool).list_matchups, fresh)
+
+@asyncreads.async_version(load_matchups_async)
+def load_matchups(fresh=False, pool=None):
+    """All matchups, ordered by sortOrder."""
+    return collection_cache.get(get_collection_path('matchups', pool), get_repository(pool).list_matchups, fresh)
+
+async def load_picks_async(fresh=False, pool=None):
+    return await collection_cache.get_async(get_collection_path('picks', pool), get_async_repository(pool).list_picks, fresh)
+
+@asyncreads.async_version(load_picks_async)
+def load_picks(fresh=False, pool=None):
+    return collection_cache.get(get_collection_path('picks', pool), get_repository(pool).list_picks, fresh)
+
+async def load_manager_picks_async(manager_id, fresh=False, pool=None):
+    path = get_collection_path('picks', pool)
+    return await collection_cache.get_async(f"{path}?managerId={manager_id}", lambda: get_async_repository(pool).list_manager_picks(manager_id), fresh)
+
+@asyncreads.async_version(load_manager_picks_async)
+def load_manager_picks(manager_id, fresh=False, pool=None):
+    path = get_collection_path('picks', pool)
+    return collection_cache.get(f"{path}?managerId={manager_id}", lambda: get_repository(pool).list_manager_picks(manager_id), fresh)
+
+async def get_manager_async(manager_id, pool=None):
+    return await get_async_repository(pool).get_manager(manager_id)
+
+@asyncreads.async_version(get_manager_async)
+def get_manager(manager_id, pool=None):
+    """One manager, read past the cache."""
+    return get_repository(pool).get_manager(manager_id)
+
+def load_concurrently(*loaders):
+    """
+    Calls independent zero-argument loads at the same time; results come back in order. Under
+    asgi.py they run on the worker's event loop (see asyncreads.py), otherwise on threads (see
+    parallelreads.py). Pass partial(load_..., ...) so that a load's async twin can be found.
+    """
+    if PARALLEL_READS and asyncreads.loop_attached():
+        return asyncreads.gather(*loaders)
+    return parallelreads.gather(*loaders, enabled=PARALLEL_READS, max_workers=READ_WORKERS)
+
+def load_pools(fresh=False):
+    """Registry of every non-default pool/season, kept in the default pool's 'pools' collection."""
+    path = get_pool(app_id).collection_path('pools')
+    return collection_cache.get(path, lambda: [doc.to_dict() for doc in get_repository(get_pool(app_id)).collection('pools').stream()], fresh)
+
+def invalidate_collections(*collection_names, pool=None):
+    collection_cache.invalidate(*[get_collection_path(name, pool) for name in collection_names])
+
+# --- Materialized standings/projections snapshot ---
+
+def get_snapshot_store(pool=None):
+    pool = pool or current_pool()
+    if SNAPSHOT_STORE == 'file':
+        if pool.is_default:
+            return FileSnapshotStore(SNAPSHOT_FILE)
+        root, ext = os.path.splitext(SNAPSHOT_FILE)
+        return FileSnapshotStore(f"{root}-{pool.key}{ext}")
+    repo = get_repository(pool)
+    return FirestoreSnapshotStore(repo.collection('snapshots').document('latest'), repo.client)
+
+def materialize_pool_snapshot(pool):
+    """Recomputes standings and projections once and stores them as a new snapshot version."""
+    # Read past this worker's cache: other workers' writes only clear their own, and the
+    # snapshot is shared by every worker until the next write.
+    managers, matchups, picks = load_concurrently(partial(load_managers, fresh=True, pool=pool), partial(load_matchups, fresh=True, pool=pool),
+                                                  partial(load_picks, fresh=True, pool=pool))
+    snapshot = materialize_snapshot(get_snapshot_store(pool), managers, matchups, picks,
+                                    num_simulations=PROJECTION_SIMULATIONS, seed=PROJECTION_SEED, method=PROJECTION_METHOD,
+                                    ci_width=PROJECTION_CI_WIDTH, max_simulations=PROJECTION_MAX_SIMULATIONS, num_workers=PROJECTION_WORKERS)
+    invalidate_collections('snapshots', pool=pool)
+    livefeed.publish(pool.key, snapshot)
+    return {'version': snapshot['version'], 'generatedAt': snapshot['generatedAt']}
+
+def refresh_snapshot(pool=None):
+    """
+    Schedules a snapshot refresh. Called from every write that can change results or picks, so
+    page views never recompute; repeated writes while a refresh is pending share one refresh.
+    """
+    pool = pool or current_pool()
+    return run_job('snapshot', pool, lambda: materialize_pool_snapshot(pool))
+
+async def load_snapshot_async(pool=None):
+    pool = pool or current_pool()
+    async def load_document():
+        if SNAPSHOT_STORE == 'file':
+            return await asyncreads.to_thread(get_snapshot_store(pool).load)
+        return await get_async_repository(pool).get_document('snapshots', 'latest')
+    snapshot = await collection_cache.get_async(get_collection_path('snapshots', pool), load_document)
+    if snapshot is None:
+        # Scheduling the first refresh (or running it, with JOBS_MODE=inline) blocks.
+        snapshot = await asyncreads.to_thread(load_snapshot, pool)
+    return snapshot
+
+@asyncreads.async_version(load_snapshot_async)
+def load_snapshot(pool=None):
+    """The latest snapshot (at most one document read per cache TTL), scheduling the first one if none exists."""
+    pool = pool or current_pool()
+    snapshot = collection_cache.get(get_collection_path('snapshots', pool), lambda: get_snapshot_store(pool).load())
+    if snapshot is None:
+        refresh_snapshot(pool)
+        snapshot = collection_cache.get(get_collection_path('snapshots', pool), lambda: get_snapshot_store(pool).load())
+    return snapshot
+
+def load_pick_matrix(pool=None):
+    """
+    The pool's compiled pick matrix, for what-if projections. Cached next to the snapshot, so it
+    is rebuilt (from freshly read collections) only when a new snapshot is materialized.
+    """
+    pool = pool or current_pool()
+    def build():
+        managers, matchups, picks = load_concurrently(partial(load_managers, fresh=True, pool=pool), partial(load_matchups, fresh=True, pool=pool),
+                                                      partial(load_picks, fresh=True, pool=pool))
+        matchups_by_id = {m['id']: m for m in matchups}
+        return build_pick_matrix(managers, matchups_by_id, group_picks_by_manager(picks))
+    return collection_cache.get(f"{get_collection_path('snapshots', pool)}?pickMatrix", build)
+
+def start_live_feed(feed, pool):
+    """
+    Feeds a pool's live updates from one snapshot listener per worker. With SNAPSHOT_STORE=file
+    there is nothing to listen to, so only snapshots materialized by this worker arrive.
+    """
+    if SNAPSHOT_STORE == 'firestore':
+        doc_ref = get_repository(pool).collection('snapshots').document('latest')
+        def on_snapshot(docs, changes, read_time):
+            for doc in docs:
+                if doc.exists:
+                    feed.publish(doc.to_dict())
+        feed.listener = doc_ref.on_snapshot(on_snapshot)
+    else:
+        feed.publish(load_snapshot(pool))
+
+live_streams = livefeed.StreamLimit(LIVE_MAX_STREAMS)
+
+def get_live_feed(pool=None):
+    pool = pool or current_pool()
+    return livefeed.get_feed(pool.key, lambda feed: start_live_feed(feed, pool))
+
+def snapshot_response(snapshot, template_name, job=None, **context):
+    """Renders a page from a snapshot with ETag/Last-Modified, answering 304 when the client is current."""
+    updating = bool(job and job['status'] in ACTIVE_STATUSES)
+    # Versions count per pool and the pool comes from the session, so the tag names the pool too.
+    etag = f"snapshot-{current_pool().key}-{snapshot['version']}{'-updating' if updating else ''}"
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template(template_name, job=job, snapshot_version=snapshot['version'], **context))
+    response.set_etag(etag)
+    response.last_modified = datetime.fromisoformat(snapshot['generatedAt'])
+    # Clients may keep the page but must revalidate it on every view.
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+# --- Background jobs ---
+
+def save_job_status(status):
+    """Persists every job state change, so any worker can report a job that ran in another one."""
+    pool = get_pool(app_id, status['context']['poolId'], status['context']['season'])
+    get_repository(pool).collection('jobs').document(status['kind']).set(status)
+    collection_cache.invalidate(get_collection_path('jobs', pool))
+
+job_runner = JobRunner(max_workers=JOB_WORKERS, on_update=save_job_status)
+
+def run_job(kind, pool, fn):
+    """Runs fn for the pool as a deduplicated background job (or inline with JOBS_MODE=inline). Returns its status."""
+    context = {'poolId': pool.pool_id, 'season': pool.season}
+    if JOBS_MODE == 'inline':
+        return job_runner.run_now(kind, pool.key, fn, context)
+    return job_runner.submit(kind, pool.key, fn, context)
+
+async def load_job_status_async(kind, fresh=False, pool=None):
+    pool = pool or current_pool()
+    status = job_runner.get(kind, pool.key)
+    if status is None:
+        jobs = await collection_cache.get_async(get_collection_path('jobs', pool), lambda: get_async_repository(pool).documents_by_id('jobs'), fresh)
+        status = jobs.get(kind)
+    return status
+
+@asyncreads.async_version(load_job_status_async)
+def load_job_status(kind, fresh=False, pool=None):
+    """This worker's status for the job, else the persisted one (written by whichever worker ran it)."""
+    pool = pool or current_pool()
+    status = job_runner.get(kind, pool.key)
+    if status is None:
+        path = get_collection_path('jobs', pool)
+        jobs = collection_cache.get(path, lambda: {doc.id: doc.to_dict() for doc in get_repository(pool).collection('jobs').stream()}, fresh)
+        status = jobs.get(kind)
+    return status
+
+def recalculate_scores_job(pool):
+    """Full rebuild of every manager's score, followed by a snapshot refresh."""
+    updated = get_repository(pool).recalculate_scores()
+    invalidate_collections('managers', pool=pool)
+    refresh_snapshot(pool)
+    return {'managersUpdated': updated}
+
+def apply_winner_changes(repo, changes):
+    """
+    Applies winner changes incrementally and refreshes the snapshot. If a pick points at a
+    manager that no longer exists, records the winners and schedules a full rebuild instead.
+    """
+    try:
+        repo.apply_winner_changes(changes)
+    except NotFound as e:
+        print(f"Incremental scoring failed ({e}). Falling back to a full recalculation.")
+        repo.set_winners(changes)
+        invalidate_collections('matchups', pool=repo.pool)
+        run_job('recalculate', repo.pool, lambda: recalculate_scores_job(repo.pool))
+        return
+    invalidate_collections('matchups', 'managers', pool=repo.pool)
+    refresh_snapshot(repo.pool)
+
+# --- Cascade deletes ---
+
+def _after_cascade_delete(pool):
+    invalidate_collections('managers', 'matchups', 'picks', pool=pool)
+    refresh_snapshot(pool)
+
+def cascade_progress_id(task_id):
+    return f"cascade-{task_id}"
+
+def _cascade_progress_saver(pool):
+    """Persists a background delete's progress in the pool's 'jobs' collection, like save_job_status."""
+    def save(progress):
+        get_repository(pool).collection('jobs').document(cascade_progress_id(progress['id'])).set(progress)
+        collection_cache.invalidate(get_collection_path('jobs', pool))
+    return save
+
+def delete_manager_and_picks(manager_id):
+    """
+    Deletes a manager and their picks. Large deletes run in the background; returns the
+    task id to poll in that case, otherwise None once everything is deleted.
+    """
+    # Captured here: background deletes run outside the request that selected the pool.
+    pool = current_pool()
+    repo = get_repository(pool)
+    total_picks = repo.count_picks('managerId', manager_id)
+    delete_fn = lambda progress=None: repo.delete_manager_cascade(manager_id, progress)
+    if total_picks > ASYNC_THRESHOLD:
+        return run_cascade_delete('manager', manager_id, total_picks, delete_fn, on_complete=lambda: _after_cascade_delete(pool),
+                                  on_update=_cascade_progress_saver(pool))
+    delete_fn()
+    _after_cascade_delete(pool)
+    return None
+
+def delete_matchup_and_picks(matchup_id):
+    """Same as delete_manager_and_picks, for a matchup (taking back any points it awarded)."""
+    pool = current_pool()
+    repo = get_repository(pool)
+    total_picks = repo.count_picks('matchupId', matchup_id)
+    delete_fn = lambda progress=None: repo.delete_matchup_cascade(matchup_id, progress)
+    if total_picks > ASYNC_THRESHOLD:
+        return run_cascade_delete('matchup', matchup_id, total_picks, delete_fn, on_complete=lambda: _after_cascade_delete(pool),
+                                  on_update=_cascade_progress_saver(pool))
+    delete_fn()
+    _after_cascade_delete(pool)
+    return None
+
+def watch_collections(pool=None):
+    """
+    Keeps the cache coherent across gunicorn workers with Firestore snapshot listeners
+    (enabled with CACHE_USE_LISTENERS=1). Each listener costs one read per changed document.
+    """
+    pool = pool or current_pool()
+    repo = get_repository(pool)
+    for collection_name in ('managers', 'matchups'):
+        query = repo.matchups.order_by("sortOrder") if collection_name == 'matchups' else repo.collection(collection_name)
+        collection_cache.watch(get_collection_path(collection_name, pool), query)
+    if repo.uses_sheets:
+        if repo.reads_legacy_picks():
+            # Not migrated yet: picks are merged from sheets and per-pick documents, which one
+            # listener cannot follow, so they stay on the TTL path until the worker restarts.
+            return
+        collection_cache.watch(get_collection_path('picks', pool), repo.pick_sheets,
+                               transform=lambda docs: [pick for doc in docs for pick in pick_sheet_picks(doc.to_dict())])
+    else:
+        collection_cache.watch(get_collection_path('picks', pool), repo.picks)
+
+def ensure_pool_initialized(pool):
+    """Per-pool setup, done once per worker the first time the pool is used rather than at startup."""
+    if pool.initialized:
+        return
+    with pool.lock:
+        if pool.initialized:
+            return
+        if db and CACHE_USE_LISTENERS:
+            watch_collections(pool)
+        pool.initialized = True
+
+# --- Datastore client ---
+
+# Path of the Firebase service account key used when DATASTORE=firestore.
+FIREBASE_CREDENTIALS_FILE = "private/web-bowl-pickem-firebase-admin-v1.json"
+
+def create_datastore_client():
+    """
+    Builds the (instrumented) client for DATASTORE. Called by the first request or command that
+    needs the datastore, never at import; data migrations run separately with `flask migrate`.
+    """
+    global firebase_app
+    if PICK_STORAGE not in PICK_STORAGE_FORMATS:
+        raise ValueError(f"Unknown PICK_STORAGE '{PICK_STORAGE}', expected one of {', '.join(PICK_STORAGE_FORMATS)}.")
+    if DATASTORE != 'firestore':
+        if DATASTORE not in DATASTORE_BACKENDS:
+            raise ValueError(f"Unknown DATASTORE '{DATASTORE}', expected one of {', '.join(DATASTORE_BACKENDS)}.")
+        if DATASTORE == 'sqlite':
+            os.makedirs(os.path.dirname(DATASTORE_FILE) or '.', exist_ok=True)
+        print(f"Using the local '{DATASTORE}' datastore.")
+        return instrumentation.instrument_client(create_local_client(DATASTORE, DATASTORE_FILE, latency_seconds=DATASTORE_LATENCY_MS / 1000))
     if firebase_app is None: # Ensure Firebase is initialized only once
-        try:
-            cred = credentials.Certificate("private/web-bowl-pickem-firebase-admin-v1.json")
-            firebase_app = firebase_admin.initialize_app(cred)
-            db = firestore.client()
-            print("Firebase initialized successfully.")
-            # Run the data migration for sortOrder after db is initialized
-            _backfill_matchup_sort_order(db)
-        except Exception as e:
-            print(f"Error initializing Firebase: {e}")
+        firebase_app = firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS_FILE))
+    client = instrumentation.instrument_client(firestore.client())
+    print("Firebase initialized successfully.")
+    return client
+
+db = LazyClient(create_datastore_client)
+
+def create_async_datastore_client():
+    """
+    The async client for reads on the ASGI worker's event loop (see asyncreads.py). Created on
+    that loop by its first read: Firestore's AsyncClient belongs to the loop it first runs on.
+    """
+    client = db.get()
+    if client is None:
+        raise RuntimeError(f"Datastore not initialized: {db.error}")
+    if DATASTORE != 'firestore':
+        # Driven through the instrumented sync client, which counts its reads.
+        return create_async_local_client(client)
+    return instrumentation.instrument_async_client(firestore_async.client(firebase_app))
+
+async_db = LazyClient(create_async_datastore_client)
 
-initialize_firebase()
+def create_app():
+    """
+    App factory for gunicorn: gunicorn --preload "main:create_app()". Only work that is safe to
+    share with forked workers happens here (compiling every template once, in the master); the
+    datastore client, job threads and cache listeners are created lazily inside each worker.
+    """
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+    return app
+
+# --- Request instrumentation ---
+
+@app.before_request
+def start_request_timer():
+    """Registered first so the timing covers pool selection as well."""
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    instrumentation.start_request(rule)
+
+@app.after_request
+def record_request_metrics(response):
+    stats = instrumentation.current_request_stats()
+    if stats is None:
+        return response
+    instrumentation.metrics.record_request(stats, request.method, response.status_code)
+    elapsed_ms = stats.elapsed() * 1000
+    firestore_ms = stats.rpc_seconds * 1000
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = (
+            f'firestore;dur={firestore_ms:.1f};desc="{stats.rpcs} rpcs, {stats.reads} reads, {stats.writes} writes", '
+            f'total;dur={elapsed_ms:.1f}')
+    if SLOW_REQUEST_MS and elapsed_ms > SLOW_REQUEST_MS:
+        print(f"--- SLOW REQUEST: {request.method} {request.full_path.rstrip('?')} took {elapsed_ms:.0f} ms "
+              f"(Firestore {firestore_ms:.0f} ms in {stats.rpcs} rpcs, {stats.reads} reads, {stats.writes} writes) ---")
+    return response
+
+@app.teardown_request
+def end_request_timer(exc):
+    instrumentation.end_request()
+
+# --- Pool selection ---
+
+# Probes and monitoring never touch the session or the datastore through pool setup.
+POOL_FREE_ENDPOINTS = {'healthz', 'readyz', 'metrics', 'static'}
+
+@app.before_request
+def select_pool():
+    """Resolves the pool for this request from ?pool=&season= (remembered in the session)."""
+    if request.endpoint in POOL_FREE_ENDPOINTS:
+        return
+    if 'pool' in request.args:
+        pool_id = request.args.get('pool') or DEFAULT_POOL_ID
+        season = request.args.get('season') or None
+        if pool_id != DEFAULT_POOL_ID and db and (pool_id, season) not in {(p['poolId'], p['season']) for p in load_pools()}:
+            return "Pool not found.", 404
+        session['pool_id'] = pool_id
+        session['season'] = season
+    g.pool = get_pool(app_id, session.get('pool_id', DEFAULT_POOL_ID), session.get('season'))
+    ensure_pool_initialized(g.pool)
+
+@app.context_processor
+def inject_pool():
+    return {'current_pool': current_pool()}
 
 # --- Flask Routes ---
 
@@ -123,12 +559,8 @@ def user_area():
 
     if db:
         try:
-            managers_ref = db.collection(get_collection_path('managers'))
-            managers = [doc.to_dict() for doc in managers_ref.stream()]
-            managers.sort(key=lambda x: x.get('name', '').lower())
-
-            matchups_ref = db.collection(get_collection_path('matchups')).order_by("sortOrder")
-            all_matchups = [doc.to_dict() for doc in matchups_ref.stream()]
+            managers = sorted(load_managers(), key=lambda x: x.get('name', '').lower())
+            all_matchups = load_matchups()
             #all_matchups.sort(key=lambda x: x.get('team1Name', '').lower())
         except Exception as e:
             print("--- ERROR FETCHING FROM FIRESTORE ---")
@@ -143,19 +575,15 @@ def user_area():
         if action == 'create_manager':
             manager_name = request.form.get('manager_name')
             if manager_name and db:
-                manager_id = str(uuid.uuid4())
-                db.collection(get_collection_path('managers')).document(manager_id).set({
-                    'id': manager_id,
-                    'name': manager_name,
-                    'totalScore': 0
-                })
+                get_repository().create_manager(manager_name)
+                invalidate_collections('managers')
+                refresh_snapshot()
         elif action == 'delete_manager':
               manager_id_to_delete = request.form.get('manager_id') # Corrected from 'manager_id'
               if manager_id_to_delete and db:
-                db.collection(get_collection_path('managers')).document(manager_id_to_delete).delete()
-                picks_ref = db.collection(get_collection_path('picks')).where('managerId', '==', manager_id_to_delete)
-                for pick_doc in picks_ref.stream():
-                    pick_doc.reference.delete()
+                task_id = delete_manager_and_picks(manager_id_to_delete)
+                if task_id:
+                    return redirect(url_for('cascade_delete_status', task_id=task_id))
         elif action == 'select_manager':
             manager_id = request.form.get('manager_id_select')
             if manager_id:
@@ -165,30 +593,16 @@ def user_area():
             team1_name = request.form.get('team1_name')
             team2_name = request.form.get('team2_name')
             if team1_name and team2_name and db:
-                matchups_ref = db.collection(get_collection_path('matchups'))
-                # Get the highest sortOrder and add 1
-                last_matchups = matchups_ref.order_by("sortOrder", direction=firestore.Query.DESCENDING).limit(1).get()
-                new_sort_order = 1
-                if last_matchups:
-                    new_sort_order = last_matchups[0].to_dict()['sortOrder'] + 1
-                
-                matchup_id = str(uuid.uuid4())
-                db.collection(get_collection_path('matchups')).document(matchup_id).set({
-                    'id': matchup_id,
-                    'team1Name': team1_name,
-                    'team2Name': team2_name,
-                    'team1Id': str(uuid.uuid4()),
-                    'team2Id': str(uuid.uuid4()),
-                    'winnerTeamId': None,
-                    'sortOrder': new_sort_order
-                })
+                # New matchups go to the end of the list
+                get_repository().create_matchup(team1_name, team2_name)
+                invalidate_collections('matchups')
+                refresh_snapshot()
         elif action == 'delete_matchup':
             matchup_id = request.form.get('matchup_id_delete')
             if matchup_id and db:
-                db.collection(get_collection_path('matchups')).document(matchup_id).delete()
-                picks_ref = db.collection(get_collection_path('picks')).where('matchupId', '==', matchup_id)
-                for pick_doc in picks_ref.stream():
-                    pick_doc.reference.delete()
+                task_id = delete_matchup_and_picks(matchup_id)
+                if task_id:
+                    return redirect(url_for('cascade_delete_status', task_id=task_id))
 
         return redirect(url_for('user_area'))
 
@@ -200,17 +614,19 @@ def user_area_manager_picks(manager_id):
     if not db:
         return "Database not initialized.", 500
 
-    manager_doc = db.collection(get_collection_path('managers')).document(manager_id).get()
-    if not manager_doc.exists:
+    repo = get_repository()
+    pool = current_pool()
+    # Saving validates against the stored sheet, so a POST must not act on cached data.
+    fresh = request.method == 'POST'
+    manager, all_matchups, manager_picks = load_concurrently(
+        partial(get_manager, manager_id, pool=pool),
+        partial(load_matchups, fresh=fresh, pool=pool),
+        partial(load_manager_picks, manager_id, fresh=fresh, pool=pool))
+    if manager is None:
         return "Manager not found.", 404
-    manager = manager_doc.to_dict()
-
-    matchups_ref = db.collection(get_collection_path('matchups')).order_by("sortOrder")
-    all_matchups = [doc.to_dict() for doc in matchups_ref.stream()]
     #all_matchups.sort(key=lambda x: x.get('team1Name', '').lower())
 
-    picks_ref = db.collection(get_collection_path('picks')).where('managerId', '==', manager_id)
-    existing_picks = {pick.get('matchupId'): pick for pick in [doc.to_dict() for doc in picks_ref.stream()]}
+    existing_picks = {pick.get('matchupId'): pick for pick in manager_picks}
 
     num_matchups = len(all_matchups)
     all_possible_points = set(range(1, num_matchups + 1))
@@ -221,256 +637,400 @@ def user_area_manager_picks(manager_id):
         action = request.form.get('action')
 
         if action == 'save_pick':
+            manager_updates = {}
             tie_breaker_score_str = request.form.get('tie_breaker_score')
             if tie_breaker_score_str and tie_breaker_score_str.isdigit():
                 tie_breaker_score = int(tie_breaker_score_str)
-                db.collection(get_collection_path('managers')).document(manager_id).set({
-                    'id': manager_id,
-                    'name': manager.get('name'),
-                    'totalScore': 0,
-                    'tieBreakerScore': tie_breaker_score
-                })
-            matchup_ids = request.form.getlist('matchup_id')
-            for matchup_id_pick in matchup_ids:
-                picked_team_id = request.form.get(f'pick_matchup_{matchup_id_pick}')
-                points_str = request.form.get(f'points_matchup_{matchup_id_pick}')
-                if not all([matchup_id_pick, picked_team_id, points_str]): continue
-                try: points = int(points_str)
-                except ValueError: continue
-                pick_doc_id = f"{manager_id}_{matchup_id_pick}"
-                db.collection(get_collection_path('picks')).document(pick_doc_id).set({
-                    'managerId': manager_id, 'matchupId': matchup_id_pick, 'pickedTeamId': picked_team_id, 'points': points
-                })
+                if tie_breaker_score != manager.get('tieBreakerScore'):
+                    manager_updates['tieBreakerScore'] = tie_breaker_score
+            try:
+                changed_picks = validate_pick_sheet(manager_id, all_matchups, existing_picks, parse_pick_form(request.form))
+            except PickSheetError as e:
+                return f"Invalid picks: {e}", 400
+
+            # Decided matchups are locked, so a valid sheet never changes the manager's score.
+            # Everything that changed goes out in one atomic batch.
+            if changed_picks or manager_updates:
+                repo.save_pick_sheet(manager_id, changed_picks, manager_updates, existing_picks=existing_picks)
+                invalidate_collections('managers', 'picks')
+                refresh_snapshot()
             return redirect(url_for('user_area_manager_picks', manager_id=manager_id))
 
         elif action == 'create_matchup':
             team1_name = request.form.get('team1_name')
             team2_name = request.form.get('team2_name')
             if team1_name and team2_name and db:
-                matchup_id_new = str(uuid.uuid4())
-                db.collection(get_collection_path('matchups')).document(matchup_id_new).set({
-                    'id': matchup_id_new, 'team1Name': team1_name, 'team2Name': team2_name,
-                    'team1Id': str(uuid.uuid4()), 'team2Id': str(uuid.uuid4()), 'winnerTeamId': None
-                })
+                repo.create_matchup(team1_name, team2_name)
+                invalidate_collections('matchups')
+                refresh_snapshot()
         elif action == 'delete_matchup':
             matchup_id_to_delete = request.form.get('matchup_id_delete')
             if matchup_id_to_delete and db:
-                db.collection(get_collection_path('matchups')).document(matchup_id_to_delete).delete()
-                picks_ref_del = db.collection(get_collection_path('picks')).where('matchupId', '==', matchup_id_to_delete)
-                for pick_doc in picks_ref_del.stream(): pick_doc.reference.delete()
+                task_id = delete_matchup_and_picks(matchup_id_to_delete)
+                if task_id:
+                    return redirect(url_for('cascade_delete_status', task_id=task_id))
         
         return redirect(url_for('user_area_manager_picks', manager_id=manager_id))
 
-    return render_template('user_manager_picks.html', manager=manager, all_matchups=all_matchups, existing_picks=existing_picks, available_points=available_points)
+    return render_template('user_manager_picks.html', manager=manager, all_matchups=all_matchups, existing_picks=existing_picks, available_points=available_points,
+                           locked_ids=locked_matchup_ids(all_matchups))
 
 @app.route('/edit-matchup/<matchup_id>', methods=['GET', 'POST'])
 def edit_matchup_page(matchup_id):
     if not db: return "Database not initialized.", 500
-    matchup_ref = db.collection(get_collection_path('matchups')).document(matchup_id)
-    matchup_doc = matchup_ref.get()
-    if not matchup_doc.exists: return "Matchup not found.", 404
+    repo = get_repository()
+    matchup = repo.get_matchup(matchup_id)
+    if matchup is None: return "Matchup not found.", 404
 
     if request.method == 'POST':
         new_team1_name = request.form.get('new_team1_name')
         new_team2_name = request.form.get('new_team2_name')
+        # Entered as a percentage; blank means a 50/50 game.
+        probability_str = (request.form.get('team1_win_percent') or '').strip()
+        try:
+            team1_win_probability = float(probability_str) / 100 if probability_str else None
+        except ValueError:
+            return "Win probability must be a number.", 400
+        if team1_win_probability is not None and not 0 <= team1_win_probability <= 1:
+            return "Win probability must be between 0 and 100.", 400
         if new_team1_name and new_team2_name:
-            matchup_ref.update({'team1Name': new_team1_name, 'team2Name': new_team2_name})
+            repo.update_matchup(matchup_id, new_team1_name, new_team2_name, team1_win_probability)
+            invalidate_collections('matchups')
+            refresh_snapshot()
             next_url = request.args.get('next') or url_for('user_area')
             return redirect(next_url)
         else: return "Missing form data.", 400
     
-    return render_template('edit_matchup.html', matchup=matchup_doc.to_dict())
+    return render_template('edit_matchup.html', matchup=matchup)
 
 @app.route('/admin', methods=['GET', 'POST'])
 def admin_area():
     if not db: return "Database not initialized.", 500
 
-    matchups_ref = db.collection(get_collection_path('matchups')).order_by("sortOrder")
-    all_matchups = [doc.to_dict() for doc in matchups_ref.stream()]
+    # Winner diffs must be computed against the stored winners, never a cached copy.
+    all_matchups = load_matchups(fresh=request.method == 'POST')
     #all_matchups.sort(key=lambda x: x.get('team1Name', '').lower())
 
     if request.method == 'POST':
-        matchup_ids = request.form.getlist('matchup_id')
-        for matchup_id in matchup_ids:
+        repo = get_repository()
+
+        if request.form.get('action') == 'recalculate_all':
+            pool = current_pool()
+            run_job('recalculate', pool, lambda: recalculate_scores_job(pool))
+            return redirect(url_for('admin_area'))
+
+        submitted_winners = {}
+        for matchup_id in request.form.getlist('matchup_id'):
             winner_team_id = request.form.get(f'winner_matchup_{matchup_id}')
             if matchup_id and winner_team_id:
-                db.collection(get_collection_path('matchups')).document(matchup_id).update({'winnerTeamId': winner_team_id})
-        
-        # Recalculate scores for all managers
-        managers_ref = db.collection(get_collection_path('managers'))
-        all_managers = [doc.to_dict() for doc in managers_ref.stream()]
-        for manager in all_managers:
-            current_score = 0
-            picks_ref = db.collection(get_collection_path('picks')).where('managerId', '==', manager['id'])
-            manager_picks = [doc.to_dict() for doc in picks_ref.stream()]
-            for pick in manager_picks:
-                matchup_doc = db.collection(get_collection_path('matchups')).document(pick['matchupId']).get()
-                if matchup_doc.exists:
-                    matchup_data = matchup_doc.to_dict()
-                    if matchup_data.get('winnerTeamId') == pick.get('pickedTeamId'):
-                        current_score += pick.get('points', 0)
-            db.collection(get_collection_path('managers')).document(manager['id']).update({'totalScore': current_score})
+                submitted_winners[matchup_id] = winner_team_id
+
+        # Only matchups whose winner changed affect scores; apply their deltas incrementally.
+        apply_winner_changes(repo, diff_winners(all_matchups, submitted_winners))
         return redirect(url_for('admin_area'))
         
-    return render_template('admin.html', all_matchups=all_matchups)
-
-# @app.route('/admin/backfill_sort_order', methods=['POST'])
-# def backfill_sort_order():
-#     """
-#     Finds any matchups that are missing a 'sortOrder' field and assigns them one.
-#     This is useful for migrating data created before the reordering feature was added.
-#     """
-#     if not db:
-#         return "Database not initialized.", 500
-
-#     matchups_ref = db.collection(get_collection_path('matchups'))
-#     all_docs = list(matchups_ref.stream())
-    
-#     docs_to_update = []
-#     docs_with_order = []
-#     for doc in all_docs:
-#         doc_data = doc.to_dict()
-#         if 'sortOrder' not in doc_data or doc_data.get('sortOrder') is None:
-#             docs_to_update.append(doc)
-#         else:
-#             docs_with_order.append(doc_data)
-
-#     if docs_to_update:
-#         next_sort_order = 1
-#         if docs_with_order:
-#             # Find the max sort order, safely handling None values
-#             max_order = max(d.get('sortOrder', 0) for d in docs_with_order if d.get('sortOrder') is not None)
-#             next_sort_order = max_order + 1
-            
-#         batch = db.batch()
-#         # Sort by ID for a consistent order before assigning new sort values
-#         docs_to_update.sort(key=lambda d: d.id)
-#         for doc in docs_to_update:
-#             batch.update(doc.reference, {'sortOrder': next_sort_order})
-#             next_sort_order += 1
-#         batch.commit()
-
-#     return redirect(url_for('admin_area'))
+    return render_template('admin.html', all_matchups=all_matchups, job=load_job_status('recalculate'))
+
+@app.cli.command('recalculate-scores')
+@click.option('--pool', 'pool_id', default=DEFAULT_POOL_ID, help="Pool id (defaults to the default pool).")
+@click.option('--season', default=None, help="Season of the pool.")
+def recalculate_scores_command(pool_id, season):
+    """Full rebuild of every manager's totalScore: flask --app main recalculate-scores"""
+    if not db:
+        print("Database not initialized.")
+        return
+    pool = get_pool(app_id, pool_id, season)
+    updated = get_repository(pool).recalculate_scores()
+    invalidate_collections('managers', pool=pool)
+    materialize_pool_snapshot(pool)
+    print(f"Recalculated scores. {updated} manager(s) updated.")
+
+@app.cli.command('migrate')
+@click.option('--pool', 'pool_id', default=DEFAULT_POOL_ID, help="Pool id (defaults to the default pool).")
+@click.option('--season', default=None, help="Season of the pool.")
+@click.option('--all-pools', is_flag=True, help="Migrate the default pool and every registered pool.")
+@click.option('--dry-run', is_flag=True, help="Only list the migrations that would run.")
+def migrate_command(pool_id, season, all_pools, dry_run):
+    """Applies pending data migrations: flask --app main migrate"""
+    if not db:
+        print("Database not initialized.")
+        return
+    pools = [get_pool(app_id, pool_id, season)]
+    if all_pools:
+        pools = [get_pool(app_id)] + [get_pool(app_id, p['poolId'], p['season']) for p in load_pools(fresh=True)]
+    for pool in pools:
+        results = run_migrations(get_repository(pool), dry_run=dry_run)
+        if not results:
+            print(f"{pool.key}: up to date ({len(MIGRATIONS)} migration(s) applied).")
+        for migration_id, result in results:
+            print(f"{pool.key}: {'would apply' if dry_run else 'applied'} {migration_id}{'' if dry_run else f' {result}'}")
+        if results and not dry_run:
+            invalidate_collections('matchups', 'managers', 'picks', pool=pool)
+
+@app.cli.command('migrate-pick-sheets')
+@click.option('--pool', 'pool_id', default=DEFAULT_POOL_ID, help="Pool id (defaults to the default pool).")
+@click.option('--season', default=None, help="Season of the pool.")
+@click.option('--all-pools', is_flag=True, help="Migrate the default pool and every registered pool.")
+@click.option('--delete-legacy', is_flag=True, help="Also delete the per-pick documents once the sheets are written.")
+def migrate_pick_sheets_command(pool_id, season, all_pools, delete_legacy):
+    """Copies per-pick documents into one pick sheet per manager: flask --app main migrate-pick-sheets"""
+    if not db:
+        print("Database not initialized.")
+        return
+    if PICK_STORAGE != 'sheets':
+        print("Set PICK_STORAGE=sheets for the app first; picks saved as documents after the migration would not be copied.")
+        return
+    pools = [get_pool(app_id, pool_id, season)]
+    if all_pools:
+        pools = [get_pool(app_id)] + [get_pool(app_id, p['poolId'], p['season']) for p in load_pools(fresh=True)]
+    for pool in pools:
+        result = migrate_pick_sheets(get_repository(pool), delete_legacy=delete_legacy)
+        invalidate_collections('picks', pool=pool)
+        print(f"{pool.key}: {result['sheetsWritten']} sheet(s) written from {result['picksCopied']} pick(s), "
+              f"{result['picksDeleted']} pick document(s) deleted.")
 
 @app.route('/move-matchup/<matchup_id>/<direction>', methods=['POST'])
 def move_matchup(matchup_id, direction):
     if not db: return "Database not initialized.", 500
-    
-    matchups_ref = db.collection(get_collection_path('matchups'))
-    
-    # Get all matchups, sorted
-    all_matchups = [doc for doc in matchups_ref.order_by("sortOrder").stream()]
-    
-    # Find the index of the matchup to move
-    doc_to_move_index = -1
-    for i, doc in enumerate(all_matchups):
-        if doc.id == matchup_id:
-            doc_to_move_index = i
-            break
-
-    if doc_to_move_index == -1:
+    if direction not in ('up', 'down'):
+        return redirect(url_for('user_area')) # No move needed
+
+    try:
+        moved = get_repository().move_matchup_step(matchup_id, direction)
+    except LookupError:
         return "Matchup not found", 404
+    if moved:
+        invalidate_collections('matchups')
 
-    # Determine the swap index
-    if direction == 'up' and doc_to_move_index > 0:
-        swap_index = doc_to_move_index - 1
-    elif direction == 'down' and doc_to_move_index < len(all_matchups) - 1:
-        swap_index = doc_to_move_index + 1
+    return redirect(url_for('user_area'))
+
+@app.route('/matchups/<matchup_id>/position', methods=['POST'])
+def position_matchup(matchup_id):
+    """Drag-and-drop: moves a matchup directly after 'after_id' (or to the top when it is empty)."""
+    if not db: return "Database not initialized.", 500
+    try:
+        get_repository().move_matchup_after(matchup_id, request.form.get('after_id') or None)
+    except LookupError as e:
+        return str(e), 404
+    invalidate_collections('matchups')
+    return redirect(request.form.get('next') or url_for('user_area'))
+
+@app.route('/matchups/reorder', methods=['POST'])
+def reorder_matchups_route():
+    """Bulk reorder: 'matchup_id' values in their new order, written in one batch."""
+    if not db: return "Database not initialized.", 500
+    ordered_ids = request.form.getlist('matchup_id')
+    known_ids = {m['id'] for m in load_matchups(fresh=True)}
+    if set(ordered_ids) != known_ids or len(ordered_ids) != len(known_ids):
+        return "The new order must list every matchup exactly once.", 400
+    get_repository().reorder_matchups(ordered_ids)
+    invalidate_collections('matchups')
+    return redirect(request.form.get('next') or url_for('user_area'))
+
+@app.cli.command('rebalance-matchups')
+@click.option('--pool', 'pool_id', default=DEFAULT_POOL_ID, help="Pool id (defaults to the default pool).")
+@click.option('--season', default=None, help="Season of the pool.")
+def rebalance_matchups_command(pool_id, season):
+    """Renumbers matchup sortOrder keys 1..N (and backfills missing ones): flask --app main rebalance-matchups"""
+    if not db:
+        print("Database not initialized.")
+        return
+    pool = get_pool(app_id, pool_id, season)
+    updated = get_repository(pool).rebalance_sort_orders()
+    invalidate_collections('matchups', pool=pool)
+    print(f"Rebalanced matchup order. {updated} matchup(s) updated.")
+
+@app.route('/pools', methods=['GET', 'POST'])
+def pools_area():
+    if not db: return "Database not initialized.", 500
+
+    if request.method == 'POST':
+        pool_id = (request.form.get('pool_id') or '').strip().lower()
+        season = (request.form.get('season') or '').strip()
+        problems = validate_pool(pool_id, season)
+        if problems:
+            return " ".join(problems), 400
+        entry = pool_registry_entry(pool_id, season, (request.form.get('pool_name') or '').strip())
+        get_repository(get_pool(app_id)).collection('pools').document(entry['id']).set(entry)
+        collection_cache.invalidate(get_pool(app_id).collection_path('pools'))
+        return redirect(url_for('pools_area', pool=pool_id, season=season))
+
+    all_pools = sorted(load_pools(), key=lambda p: (p.get('name', '').lower(), p.get('season', '')))
+    return render_template('pools.html', all_pools=all_pools)
+
+@app.route('/export/<dataset>.<file_format>')
+def export_data(dataset, file_format):
+    """Streams every pick or every result as CSV or XLSX (picks are read as a stream, not loaded up front)."""
+    if not db: return "Database not initialized.", 500
+    if dataset not in ('picks', 'results') or file_format not in ('csv', 'xlsx'):
+        return "Unknown export.", 404
+
+    matchups_by_id = {m['id']: m for m in load_matchups()}
+    if dataset == 'picks':
+        managers_by_id = {m['id']: m for m in load_managers()}
+        header = PICK_COLUMNS
+        rows = iter_pick_rows(get_repository().stream_picks(), managers_by_id, matchups_by_id)
     else:
-        return redirect(url_for('user_area')) # No move needed
+        header = RESULT_COLUMNS
+        rows = iter_result_rows(load_matchups())
 
-    # Get the two documents to swap
-    doc1 = all_matchups[doc_to_move_index]
-    doc2 = all_matchups[swap_index]
+    filename = f"{dataset}-{current_pool().key}.{file_format}"
+    if file_format == 'csv':
+        body, mimetype = stream_csv(header, rows), 'text/csv'
+    else:
+        body, mimetype = stream_xlsx(header, rows), XLSX_MIMETYPE
+    return Response(stream_with_context(body), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
-    # Swap their sortOrder values
-    sort_order_1 = doc1.to_dict()['sortOrder']
-    sort_order_2 = doc2.to_dict()['sortOrder']
-    
-    # Perform the swap in a transaction
-    @firestore.transactional
-    def swap_order(transaction, ref1, ref2):
-        transaction.update(ref1, {'sortOrder': sort_order_2})
-        transaction.update(ref2, {'sortOrder': sort_order_1})
+@app.route('/import/<dataset>', methods=['POST'])
+def import_data(dataset):
+    """Imports a picks sheet or a results file (CSV or XLSX, same columns as the export)."""
+    if not db: return "Database not initialized.", 500
+    if dataset not in ('picks', 'results'):
+        return "Unknown import.", 404
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return "No file uploaded.", 400
 
-    transaction = db.transaction()
-    swap_order(transaction, doc1.reference, doc2.reference)
+    try:
+        # Validation must see the stored data, not a cached copy.
+        repo = get_repository()
+        all_matchups = load_matchups(fresh=True)
+        if dataset == 'picks':
+            all_picks = load_picks(fresh=True)
+            changed_by_manager = validate_pick_import(iter_upload_rows(upload), load_managers(fresh=True), all_matchups, all_picks)
+            repo.save_pick_sheets(changed_by_manager, group_picks_by_manager(all_picks))
+            invalidate_collections('picks')
+        else:
+            changes = diff_winners(all_matchups, parse_results(iter_upload_rows(upload), all_matchups))
+    except TransferError as e:
+        return f"Import failed, nothing was saved: {e}", 400
+    except UPLOAD_READ_ERRORS as e:
+        return f"Could not read the uploaded file: {e}", 400
+    if dataset == 'picks':
+        refresh_snapshot()
+    else:
+        apply_winner_changes(repo, changes)
+    return redirect(url_for('admin_area'))
 
-    return redirect(url_for('user_area'))
+@app.route('/jobs/<kind>')
+def job_status(kind):
+    """Status and latest result of the pool's 'snapshot' or 'recalculate' job, polled by the templates."""
+    if not db: return jsonify({'error': 'Database not initialized.'}), 500
+    status = load_job_status(kind, fresh=True) if kind in ('snapshot', 'recalculate') else None
+    if status is None: return jsonify({'error': 'Unknown job.'}), 404
+    return jsonify(status)
+
+@app.route('/cascade-deletes/<task_id>')
+def cascade_delete_status(task_id):
+    """Progress of a background cascade delete, from this worker or as persisted by the one running it."""
+    progress = get_cascade_progress(task_id)
+    if progress is None:
+        if not db: return "Database not initialized.", 500
+        doc = get_repository(current_pool()).collection('jobs').document(cascade_progress_id(task_id)).get()
+        progress = doc.to_dict() if doc.exists else None
+    if progress is None: return jsonify({'error': 'Unknown task.'}), 404
+    return jsonify(progress)
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Hit/miss counters for the collection cache, to verify that read costs drop."""
+    return jsonify(collection_cache.stats())
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the worker is up and serving. Never touches the datastore."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness: the datastore client can be created (creating it now if this worker has not yet,
+    so the first real request does not pay for it). Answers 503 until it can.
+    """
+    if not db:
+        return jsonify({'status': 'unavailable', 'datastore': DATASTORE}), 503
+    return jsonify({'status': 'ready', 'datastore': DATASTORE})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this worker's request and Firestore counters."""
+    cache = collection_cache.stats()
+    body = instrumentation.metrics.render([
+        ('pickem_cache_hits_total', 'counter', 'Collection cache hits.', cache['hits']),
+        ('pickem_cache_misses_total', 'counter', 'Collection cache misses.', cache['misses']),
+        ('pickem_cache_entries', 'gauge', 'Collection cache entries.', cache['entries']),
+        ('pickem_live_streams', 'gauge', 'Live event streams open in this worker.', live_streams.open_streams),
+    ])
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 @app.route('/standings')
 def standings_area():
     if not db: return "Database not initialized.", 500
-    managers_ref = db.collection(get_collection_path('managers'))
-    all_managers = [doc.to_dict() for doc in managers_ref.stream()]
-    matchups_ref = db.collection(get_collection_path('matchups'))
-    all_matchups = {m['id']: m for m in [doc.to_dict() for doc in matchups_ref.stream()]}
-    picks_ref = db.collection(get_collection_path('picks'))
-    all_picks_raw = [doc.to_dict() for doc in picks_ref.stream()]
-    all_manager_picks = {}
-    for pick in all_picks_raw:
-        manager_id = pick['managerId']
-        if manager_id not in all_manager_picks: all_manager_picks[manager_id] = {}
-        all_manager_picks[manager_id][pick['matchupId']] = pick
-
-    standings_data = []
-    for manager in all_managers:
-        manager_id = manager['id']
-        tieBreaker = manager.get('tieBreakerScore', 0)
-        total_score = manager.get('totalScore', 0)
-        max_possible_score = total_score
-        manager_picks = all_manager_picks.get(manager_id, {})
-        for matchup_id, pick_data in manager_picks.items():
-            matchup = all_matchups.get(matchup_id)
-            if matchup and matchup.get('winnerTeamId') is None:
-                max_possible_score += pick_data.get('points', 0)
-        standings_data.append({
-            'name': manager['name'], 'totalScore': total_score, 'maxPossibleScore': max_possible_score, 'tieBreakerScore': tieBreaker
-        })
-    standings_data.sort(key=lambda x: x['totalScore'], reverse=True)
-    return render_template('standings.html', standings=standings_data)
+    pool = current_pool()
+    snapshot, job = load_concurrently(partial(load_snapshot, pool), partial(load_job_status, 'snapshot', pool=pool))
+    if snapshot is None:
+        # The first snapshot is being computed; the page polls the job and reloads when it is ready.
+        # The status is read again, since the refresh load_snapshot just scheduled may postdate the one above.
+        job = load_job_status('snapshot', pool=pool)
+        return render_template('standings.html', standings=[], job=job), 202
+    return snapshot_response(snapshot, 'standings.html', job=job, standings=snapshot['standings'])
 
 @app.route('/projections')
 def projections_area():
     if not db: return "Database not initialized.", 500
-    managers_ref = db.collection(get_collection_path('managers'))
-    all_managers = [doc.to_dict() for doc in managers_ref.stream()]
-    matchups_ref = db.collection(get_collection_path('matchups'))
-    all_matchups = {m['id']: m for m in [doc.to_dict() for doc in matchups_ref.stream()]}
-    picks_ref = db.collection(get_collection_path('picks'))
-    all_picks_raw = [doc.to_dict() for doc in picks_ref.stream()]
-    all_manager_picks = {}
-    for pick in all_picks_raw:
-        manager_id = pick['managerId']
-        if manager_id not in all_manager_picks: all_manager_picks[manager_id] = {}
-        all_manager_picks[manager_id][pick['matchupId']] = pick
-
-    remaining_matchups = [m for m in all_matchups.values() if m.get('winnerTeamId') is None]
-    num_simulations = 10000
-    manager_win_counts = {manager['id']: 0 for manager in all_managers}
-
-    for _ in range(num_simulations):
-        simulated_scores = {manager['id']: manager.get('totalScore', 0) for manager in all_managers}
-        for r_matchup in remaining_matchups:
-            winner_team_id = random.choice([r_matchup['team1Id'], r_matchup['team2Id']])
-            for manager in all_managers:
-                manager_id = manager['id']
-                manager_pick = all_manager_picks.get(manager_id, {}).get(r_matchup['id'])
-                if manager_pick and manager_pick['pickedTeamId'] == winner_team_id:
-                    simulated_scores[manager_id] += manager_pick['points']
-        if not simulated_scores: continue
-        max_score = max(simulated_scores.values())
-        winning_managers_in_sim = [mid for mid, score in simulated_scores.items() if score == max_score]
-        for winner_id in winning_managers_in_sim:
-            manager_win_counts[winner_id] += 1
-
-    projections = []
-    for manager in all_managers:
-        manager_id = manager['id']
-        probability = (manager_win_counts[manager_id] / num_simulations) * 100 if num_simulations > 0 else 0
-        projections.append({'name': manager['name'], 'probability': f"{probability:.2f}%"})
-    projections.sort(key=lambda x: float(x['probability'].strip('%')), reverse=True)
-    return render_template('projections.html', projections=projections)
+    pool = current_pool()
+    snapshot, job, all_matchups = load_concurrently(partial(load_snapshot, pool), partial(load_job_status, 'snapshot', pool=pool),
+                                                    partial(load_matchups, pool=pool))
+    if snapshot is None:
+        job = load_job_status('snapshot', pool=pool)
+        return render_template('projections.html', projections=[], job=job, projection_method=None,
+                               num_simulations=PROJECTION_SIMULATIONS, num_remaining=0), 202
+    remaining_matchups = [m for m in all_matchups if m.get('winnerTeamId') is None]
+    return snapshot_response(snapshot, 'projections.html', job=job, projections=snapshot['projections'],
+                             remaining_matchups=remaining_matchups, **snapshot['projectionInfo'])
+
+@app.route('/live')
+def live_updates():
+    """
+    Server-Sent Events with the pool's standings and projections: 'update' events carry only
+    the rows that changed since the version the page shows (?since=, or Last-Event-ID when the
+    browser reconnects), 'snapshot' events the whole tables.
+    """
+    if not db: return "Database not initialized.", 500
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = int(since) if since and since.isdigit() else None
+    feed = get_live_feed()
+    if not live_streams.try_acquire():
+        return "Too many live viewers, try again later.", 503, {'Retry-After': str(livefeed.RETRY_AFTER_SECONDS)}
+    response = Response(feed.stream(since, LIVE_STREAM_SECONDS), mimetype='text/event-stream')
+    response.call_on_close(live_streams.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stops nginx-style proxies from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/projections/what-if', methods=['GET', 'POST'])
+def projections_what_if():
+    """
+    Projections with some outcomes forced, as JSON. POST {"winners": {matchupId: teamId}}, or
+    GET ?winner=<matchupId>:<teamId> (repeatable). Answered from the cached pick matrix.
+    """
+    if not db: return jsonify({'error': 'Database not initialized.'}), 500
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        submitted_winners = (body.get('winners') or {}) if isinstance(body, dict) else None
+        if not isinstance(submitted_winners, dict):
+            return jsonify({'error': "'winners' must map matchup ids to team ids."}), 400
+    else:
+        submitted_winners = dict(value.split(':', 1) for value in request.args.getlist('winner') if ':' in value)
+
+    matchups_by_id = {m['id']: m for m in load_matchups()}
+    try:
+        team1_won = resolve_forced_outcomes(matchups_by_id, submitted_winners)
+    except WhatIfError as e:
+        return jsonify({'error': str(e), 'problems': e.problems}), 400
+    projections, projection_info = project_what_if(load_pick_matrix(), load_managers(), team1_won, seed=PROJECTION_SEED)
+    return jsonify({'winners': submitted_winners, 'projections': projections, 'projectionInfo': projection_info})
 
 #if __name__ == '__main__':
     #app.run(debug=False, use_reloader=False, host='0.0.0.0', port=5000)
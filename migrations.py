@@ -0,0 +1,101 @@
+# migrations.py
+"""
+One-off data migrations, run with `flask --app main migrate` (e.g. as a release step) instead
+of on every worker's startup. Each pool records the migrations it has had in its 'migrations'
+collection, so running the command again only applies new ones.
+"""
+from datetime import datetime, timezone
+
+from batches import commit_in_chunks
+from picksheet import pick_sheet_document
+from pools import pool_key
+from repository import PICK_SHEETS_MIGRATION_ID
+
+
+def backfill_matchup_sort_order(repo):
+    """Matchups created before reordering existed get a sortOrder after the current last one."""
+    return {'matchupsUpdated': repo.backfill_sort_orders()}
+
+
+def rekey_pool_registry(repo):
+    """
+    Moves registry entries saved under the old '<pool>-<season>' ids (ambiguous, since both may
+    contain dashes) to pool_key() ids. Only the default pool has a registry; elsewhere it is a no-op.
+    """
+    writes = []
+    for doc in repo.collection('pools').stream():
+        entry = doc.to_dict()
+        key = pool_key(entry['poolId'], entry['season'])
+        if doc.id != key:
+            writes += [(repo.collection('pools').document(key), dict(entry, id=key)), (doc.reference, None)]
+    commit_in_chunks(repo.client, writes, operation='set')
+    return {'entriesRekeyed': len(writes) // 2}
+
+
+# (id, function) in the order they are applied; ids must never change once released.
+MIGRATIONS = [
+    ('0001-backfill-matchup-sort-order', backfill_matchup_sort_order),
+    ('0002-rekey-pool-registry', rekey_pool_registry),
+]
+
+
+def applied_migrations(repo):
+    """Migration id -> record, for the migrations already applied to the repository's pool."""
+    return {doc.id: doc.to_dict() for doc in repo.collection('migrations').stream()}
+
+
+def pending_migrations(repo):
+    applied = applied_migrations(repo)
+    return [(migration_id, fn) for migration_id, fn in MIGRATIONS if migration_id not in applied]
+
+
+def run_migrations(repo, dry_run=False):
+    """
+    Applies every pending migration in order, recording each one as soon as it succeeds.
+    Stops at the first failure (the exception propagates). Returns [(id, result)].
+    """
+    results = []
+    for migration_id, fn in pending_migrations(repo):
+        if dry_run:
+            results.append((migration_id, None))
+            continue
+        result = fn(repo)
+        repo.collection('migrations').document(migration_id).set({
+            'id': migration_id,
+            'appliedAt': datetime.now(timezone.utc).isoformat(),
+            'result': result,
+        })
+        results.append((migration_id, result))
+    return results
+
+
+def migrate_pick_sheets(repo, delete_legacy=False):
+    """
+    Moves a pool to pick sheet storage: copies the per-pick documents into one 'pickSheets'
+    document per manager, keeping any sheet a manager already saved, then records the
+    migration so reads stop falling back to per-pick documents. Run it once the app uses
+    PICK_STORAGE=sheets, since picks saved in the old format afterwards would not be copied.
+    delete_legacy also deletes the per-pick documents. Returns counts of what was done.
+    """
+    existing_sheet_ids = {doc.id for doc in repo.pick_sheets.stream()}
+    legacy_refs = []
+    sheets = {}
+    for doc in repo.picks.stream():
+        legacy_refs.append(doc.reference)
+        pick = doc.to_dict()
+        if pick.get('managerId') not in existing_sheet_ids:
+            sheets.setdefault(pick['managerId'], {})[pick['matchupId']] = pick
+
+    commit_in_chunks(repo.client, [(repo.pick_sheets.document(manager_id), pick_sheet_document(manager_id, picks))
+                                   for manager_id, picks in sheets.items()], operation='set')
+    result = {'sheetsWritten': len(sheets), 'picksCopied': sum(len(picks) for picks in sheets.values()),
+              'picksDeleted': len(legacy_refs) if delete_legacy else 0}
+    repo.collection('migrations').document(PICK_SHEETS_MIGRATION_ID).set({
+        'id': PICK_SHEETS_MIGRATION_ID,
+        'appliedAt': datetime.now(timezone.utc).isoformat(),
+        'result': result,
+    })
+    repo.pool.pick_sheets_migrated = True
+    if delete_legacy:
+        commit_in_chunks(repo.client, [(ref, None) for ref in legacy_refs])
+    return result
@@ -0,0 +1,131 @@
+# ordering.py
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+from batches import commit_in_chunks
+
+# Matchups are ordered by a numeric 'sortOrder' rank. Moves give the matchup a key halfway
+# between its new neighbours, so a move writes one document. Once two neighbours are
+# closer than this, the whole list is renumbered 1..N.
+MIN_SORT_GAP = 1e-6
+
+
+def next_sort_order(matchups_ref):
+    """sortOrder for a matchup added at the end of the list (one bounded query)."""
+    last_matchups = matchups_ref.order_by("sortOrder", direction=firestore.Query.DESCENDING).limit(1).get()
+    if last_matchups:
+        return int(last_matchups[0].to_dict()['sortOrder']) + 1
+    return 1
+
+
+def _neighbour(matchups_ref, matchup_doc, direction):
+    """The matchup directly above ('up') or below ('down') matchup_doc, or None."""
+    order = firestore.Query.DESCENDING if direction == 'up' else firestore.Query.ASCENDING
+    # Cursoring from the snapshot also uses the document name, so equal sortOrders still page correctly.
+    neighbours = matchups_ref.order_by("sortOrder", direction=order).start_after(matchup_doc).limit(1).get()
+    return neighbours[0] if neighbours else None
+
+
+def move_matchup_step(db, matchups_ref, matchup_id, direction):
+    """
+    Swaps a matchup with its neighbour above or below it. Reads the matchup and its one
+    neighbour and writes both in a transaction. Returns False if there is nothing to move.
+    """
+    matchup_doc = matchups_ref.document(matchup_id).get()
+    if not matchup_doc.exists:
+        raise LookupError(f"Matchup {matchup_id} not found.")
+    neighbour_doc = _neighbour(matchups_ref, matchup_doc, direction)
+    if neighbour_doc is None:
+        return False
+    if neighbour_doc.get('sortOrder') == matchup_doc.get('sortOrder'):
+        # Tied keys cannot be swapped; renumber and look again.
+        rebalance_sort_orders(db, matchups_ref)
+        return move_matchup_step(db, matchups_ref, matchup_id, direction)
+
+    @firestore.transactional
+    def swap_order(transaction, ref1, ref2):
+        sort_order_1 = ref1.get(transaction=transaction).get('sortOrder')
+        sort_order_2 = ref2.get(transaction=transaction).get('sortOrder')
+        transaction.update(ref1, {'sortOrder': sort_order_2})
+        transaction.update(ref2, {'sortOrder': sort_order_1})
+
+    swap_order(db.transaction(), matchup_doc.reference, neighbour_doc.reference)
+    return True
+
+
+def move_matchup_after(db, matchups_ref, matchup_id, after_id=None):
+    """
+    Drag-and-drop move: places a matchup directly after after_id, or first when after_id is
+    None. Reads the anchor and the one matchup that follows it, then writes a single new key.
+    """
+    if after_id == matchup_id:
+        return
+    if after_id:
+        anchor_doc = matchups_ref.document(after_id).get()
+        if not anchor_doc.exists:
+            raise LookupError(f"Matchup {after_id} not found.")
+        lower = anchor_doc.get('sortOrder')
+        # The matchup being moved may itself follow the anchor, so fetch one extra.
+        following = matchups_ref.order_by("sortOrder").start_after(anchor_doc).limit(2).get()
+    else:
+        lower = None
+        following = matchups_ref.order_by("sortOrder").limit(2).get()
+    following = [doc for doc in following if doc.id != matchup_id]
+    upper = following[0].get('sortOrder') if following else None
+
+    if lower is None and upper is None:
+        new_sort_order = 1
+    elif lower is None:
+        new_sort_order = upper - 1
+    elif upper is None:
+        new_sort_order = lower + 1
+    elif upper - lower < MIN_SORT_GAP:
+        rebalance_sort_orders(db, matchups_ref)
+        return move_matchup_after(db, matchups_ref, matchup_id, after_id)
+    else:
+        new_sort_order = (lower + upper) / 2
+    try:
+        matchups_ref.document(matchup_id).update({'sortOrder': new_sort_order})
+    except NotFound:
+        # Checked by the write itself rather than an extra read.
+        raise LookupError(f"Matchup {matchup_id} not found.")
+
+
+def _write_sort_orders(db, matchups_ref, updates):
+    """updates: list of (matchup_id, sortOrder)."""
+    commit_in_chunks(db, [(matchups_ref.document(matchup_id), {'sortOrder': sort_order}) for matchup_id, sort_order in updates])
+
+
+def reorder_matchups(db, matchups_ref, ordered_ids):
+    """Bulk reorder: assigns sortOrder 1..N in the given order, in one batch for up to 500 matchups."""
+    _write_sort_orders(db, matchups_ref, [(matchup_id, i) for i, matchup_id in enumerate(ordered_ids, start=1)])
+
+
+def rebalance_sort_orders(db, matchups_ref):
+    """
+    Renumbers every matchup 1..N in its current order, writing only the keys that change.
+    Matchups missing a sortOrder are appended at the end. Returns the number of matchups updated.
+    """
+    ordered = [doc for doc in matchups_ref.order_by("sortOrder").stream()]
+    ordered_ids = {doc.id for doc in ordered}
+    missing = sorted((doc for doc in matchups_ref.stream() if doc.id not in ordered_ids), key=lambda d: d.id)
+    updates = []
+    for i, doc in enumerate(ordered + missing, start=1):
+        if doc.to_dict().get('sortOrder') != i:
+            updates.append((doc.id, i))
+    _write_sort_orders(db, matchups_ref, updates)
+    return len(updates)
+
+
+def backfill_sort_orders(db, matchups_ref):
+    """
+    Gives matchups without a numeric sortOrder one after the current maximum, in id order,
+    leaving every other matchup alone. Returns the number of matchups updated.
+    """
+    docs = list(matchups_ref.stream())
+    orders = [doc.to_dict().get('sortOrder') for doc in docs]
+    max_order = max((order for order in orders if isinstance(order, (int, float)) and not isinstance(order, bool)), default=0)
+    missing = sorted((doc.id for doc, order in zip(docs, orders) if not isinstance(order, (int, float)) or isinstance(order, bool)))
+    updates = [(matchup_id, int(max_order) + i) for i, matchup_id in enumerate(missing, start=1)]
+    _write_sort_orders(db, matchups_ref, updates)
+    return len(updates)
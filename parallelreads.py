@@ -0,0 +1,53 @@
+# parallelreads.py
+"""
+Parallel datastore reads for request handlers.
+
+A page that needs a manager, the matchups and that manager's picks used to wait for three
+round trips one after another; gather() issues them at the same time on a shared thread pool,
+so the page waits for the slowest one instead of their sum. This is plain thread concurrency
+over the regular (thread-safe) client, not asyncio.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+
+# Threads shared by every request in the worker.
+DEFAULT_MAX_WORKERS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_executor(max_workers=DEFAULT_MAX_WORKERS):
+    """The worker's read pool, created on first use so that no threads exist before gunicorn forks."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='reads')
+    return _executor
+
+
+def _run_loader(context, loader):
+    _local.in_pool = True
+    try:
+        # The caller's context carries the Flask request and its Firestore counters.
+        return context.run(loader)
+    finally:
+        _local.in_pool = False
+
+
+def gather(*loaders, enabled=True, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Calls each zero-argument loader and returns their results in order: the first one on the
+    calling thread, the others on the read pool at the same time, unless enabled is false or
+    there is nothing to overlap. The first exception raised (in loader order) propagates.
+    """
+    # A loader that gathers again would wait on threads of the pool it is occupying.
+    if not enabled or len(loaders) < 2 or getattr(_local, 'in_pool', False):
+        return [loader() for loader in loaders]
+    executor = get_executor(max_workers)
+    futures = [executor.submit(_run_loader, contextvars.copy_context(), loader) for loader in loaders[1:]]
+    first = loaders[0]()
+    return [first] + [future.result() for future in futures]
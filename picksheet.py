@@ -0,0 +1,114 @@
+# picksheet.py
+
+
+class PickSheetError(ValueError):
+    """Raised when a submitted pick sheet breaks one of the sheet rules. Holds every problem found."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(" ".join(problems))
+
+
+def locked_matchup_ids(all_matchups):
+    """
+    Matchups are played in sortOrder, so once any matchup has a winner, it and every
+    matchup ordered before it are locked.
+    """
+    decided_orders = [m.get('sortOrder') for m in all_matchups if m.get('winnerTeamId') is not None and m.get('sortOrder') is not None]
+    if not decided_orders:
+        return {m['id'] for m in all_matchups if m.get('winnerTeamId') is not None}
+    lock_through = max(decided_orders)
+    return {m['id'] for m in all_matchups
+            if m.get('winnerTeamId') is not None or (m.get('sortOrder') is not None and m['sortOrder'] <= lock_through)}
+
+
+def parse_pick_form(form):
+    """
+    Reads the save_pick form into {matchup_id: (picked_team_id, points_str)}, skipping
+    matchups where the team or the points were left blank.
+    """
+    submitted = {}
+    for matchup_id in form.getlist('matchup_id'):
+        picked_team_id = form.get(f'pick_matchup_{matchup_id}')
+        points_str = form.get(f'points_matchup_{matchup_id}')
+        if not all([matchup_id, picked_team_id, points_str]): continue
+        submitted[matchup_id] = (picked_team_id, points_str)
+    return submitted
+
+
+def validate_pick_sheet(manager_id, all_matchups, existing_picks, submitted):
+    """
+    Validates a whole submission up front against the stored sheet and returns only the
+    picks that change, as {matchup_id: pick_data}. Raises PickSheetError if:
+      - a matchup does not exist or the team is not one of its two teams,
+      - points are not an integer in 1..N (N = number of matchups),
+      - a locked matchup's pick would change,
+      - the resulting sheet uses the same points twice.
+    """
+    matchups_by_id = {m['id']: m for m in all_matchups}
+    num_matchups = len(all_matchups)
+    locked_ids = locked_matchup_ids(all_matchups)
+    problems = []
+    changed_picks = {}
+
+    for matchup_id, (picked_team_id, points_value) in submitted.items():
+        matchup = matchups_by_id.get(matchup_id)
+        if not matchup:
+            problems.append(f"Matchup {matchup_id} does not exist.")
+            continue
+        label = f"{matchup.get('team1Name')} vs {matchup.get('team2Name')}"
+        if picked_team_id not in (matchup.get('team1Id'), matchup.get('team2Id')):
+            problems.append(f"{label}: picked team is not in this matchup.")
+            continue
+        try:
+            points = int(points_value)
+        except (TypeError, ValueError):
+            problems.append(f"{label}: points must be a whole number.")
+            continue
+        if not 1 <= points <= num_matchups:
+            problems.append(f"{label}: points must be between 1 and {num_matchups}.")
+            continue
+
+        existing = existing_picks.get(matchup_id)
+        if existing and existing.get('pickedTeamId') == picked_team_id and existing.get('points') == points:
+            continue
+        if matchup_id in locked_ids:
+            problems.append(f"{label}: picks are locked for this matchup.")
+            continue
+        changed_picks[matchup_id] = {'managerId': manager_id, 'matchupId': matchup_id, 'pickedTeamId': picked_team_id, 'points': points}
+
+    # Point uniqueness is checked on the sheet as it would look after saving.
+    final_sheet = dict(existing_picks)
+    final_sheet.update(changed_picks)
+    used_by = {}
+    for matchup_id, pick in final_sheet.items():
+        if matchup_id not in matchups_by_id: continue
+        used_by.setdefault(pick.get('points'), []).append(matchup_id)
+    for points, matchup_ids in sorted(used_by.items(), key=lambda item: (item[0] is None, item[0] or 0)):
+        # Clashes confined to locked matchups can no longer be fixed by the manager, so they are not reported.
+        if len(matchup_ids) > 1 and not all(mid in locked_ids for mid in matchup_ids):
+            labels = ", ".join(f"{matchups_by_id[mid].get('team1Name')} vs {matchups_by_id[mid].get('team2Name')}" for mid in matchup_ids)
+            problems.append(f"{points} points are assigned more than once ({labels}).")
+
+    if problems:
+        raise PickSheetError(problems)
+    return changed_picks
+
+
+def pick_sheet_document(manager_id, manager_picks):
+    """
+    One manager's whole pick sheet as a single document: {matchup_id: {pickedTeamId, points}}.
+    manager_picks is {matchup_id: pick}, as used by validate_pick_sheet.
+    """
+    return {
+        'managerId': manager_id,
+        'picks': {matchup_id: {'pickedTeamId': pick.get('pickedTeamId'), 'points': pick.get('points')}
+                  for matchup_id, pick in manager_picks.items()},
+    }
+
+
+def pick_sheet_picks(sheet):
+    """Expands a pick sheet document into the per-pick dicts the rest of the app works with."""
+    manager_id = sheet['managerId']
+    return [{'managerId': manager_id, 'matchupId': matchup_id, 'pickedTeamId': pick.get('pickedTeamId'), 'points': pick.get('points')}
+            for matchup_id, pick in (sheet.get('picks') or {}).items()]
@@ -0,0 +1,87 @@
+# pools.py
+from datetime import datetime, timezone
+import re
+import threading
+
+# The default pool keeps using the original, unscoped collection paths, so existing data
+# needs no migration. Every other pool/season gets its own subcollections.
+DEFAULT_POOL_ID = 'default'
+POOL_ID_PATTERN = re.compile(r'^[a-z0-9][a-z0-9-]{0,62}$')
+SEASON_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9-]{0,31}$')
+# Joins pool id and season in keys; neither pattern allows it, so no two pools share a key.
+POOL_KEY_SEPARATOR = '~'
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class Pool:
+    """
+    One office pool in one season. Knows where its collections live; anything expensive
+    attached to a pool (cache listeners, snapshot stores) is set up on first use, not at startup.
+    """
+
+    def __init__(self, app_id, pool_id=DEFAULT_POOL_ID, season=None):
+        self.app_id = app_id
+        self.pool_id = pool_id
+        self.season = season
+        self.initialized = False
+        # Set once this worker has seen the pool's pick sheet migration record; never reset.
+        self.pick_sheets_migrated = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_default(self):
+        return self.pool_id == DEFAULT_POOL_ID and not self.season
+
+    @property
+    def key(self):
+        return DEFAULT_POOL_ID if self.is_default else pool_key(self.pool_id, self.season)
+
+    def collection_path(self, collection_name):
+        if self.is_default:
+            if self.app_id:
+                return f"artifacts/{self.app_id}/public/data/{collection_name}"
+            return collection_name # Fallback for local testing
+        base = f"pools/{self.pool_id}/seasons/{self.season}"
+        if self.app_id:
+            base = f"artifacts/{self.app_id}/{base}"
+        return f"{base}/{collection_name}"
+
+
+def pool_key(pool_id, season):
+    """Unique key of a non-default pool/season (registry id, job scope, live feed, snapshot file)."""
+    return f"{pool_id}{POOL_KEY_SEPARATOR}{season}"
+
+
+def get_pool(app_id, pool_id=DEFAULT_POOL_ID, season=None):
+    """Returns the cached Pool for (app_id, pool_id, season), creating it on first use."""
+    if pool_id == DEFAULT_POOL_ID:
+        season = None
+    key = (app_id, pool_id, season)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(key, Pool(app_id, pool_id, season))
+    return pool
+
+
+def validate_pool(pool_id, season):
+    """Returns a list of problems with a new pool's id/season (document ids cannot contain '/')."""
+    problems = []
+    if not pool_id or not POOL_ID_PATTERN.match(pool_id) or pool_id == DEFAULT_POOL_ID:
+        problems.append("Pool id must be lowercase letters, digits and dashes (and not 'default').")
+    if not season or not SEASON_PATTERN.match(season):
+        problems.append("Season must be letters, digits and dashes, e.g. 2025.")
+    return problems
+
+
+def pool_registry_entry(pool_id, season, name):
+    """Registry document (stored in the default pool's 'pools' collection) describing a pool."""
+    return {
+        'id': pool_key(pool_id, season),
+        'poolId': pool_id,
+        'season': season,
+        'name': name or pool_id,
+        'createdAt': datetime.now(timezone.utc).isoformat(),
+    }
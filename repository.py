@@ -0,0 +1,362 @@
+# repository.py
+import os
+import threading
+import time
+import uuid
+
+from batches import MAX_BATCH_WRITES
+import cascade
+import ordering
+from picksheet import pick_sheet_document, pick_sheet_picks
+import scoring
+
+# Which document store backs the app: 'firestore' (default), 'sqlite' (a local file) or 'memory'.
+DATASTORE_BACKENDS = ('firestore', 'sqlite', 'memory')
+# How picks are stored: 'documents' is one document per (manager, matchup) in 'picks';
+# 'sheets' is one document per manager in 'pickSheets' holding the whole sheet.
+PICK_STORAGE_FORMATS = ('documents', 'sheets')
+# Migration record (in the pool's 'migrations' collection) written once every sheet is built.
+PICK_SHEETS_MIGRATION_ID = 'pick-sheets'
+
+
+def create_local_client(backend, path=None, latency_seconds=0):
+    """
+    Client for the local backends; 'memory' is an in-process SQLite database that starts empty.
+    latency_seconds simulates the Firestore round trip of every read and commit.
+    """
+    from localstore import LocalClient
+    if backend == 'memory':
+        return LocalClient(':memory:', latency_seconds=latency_seconds)
+    return LocalClient(path, latency_seconds=latency_seconds)
+
+
+def create_async_local_client(client):
+    """Async reads (see AsyncPoolRepository) over a client from create_local_client()."""
+    from localstore import AsyncLocalClient
+    return AsyncLocalClient(client)
+
+
+class LazyClient:
+    """
+    Datastore client created on first use rather than at import, so that gunicorn --preload can
+    import the app in the master without opening gRPC channels (or SQLite connections) that the
+    forked workers would then share. A client created in another process is never reused, and a
+    failed attempt is retried after retry_seconds. Truthiness answers "is the datastore usable?".
+    """
+
+    def __init__(self, factory, retry_seconds=30):
+        self._factory = factory
+        self._retry_seconds = retry_seconds
+        self._client = None
+        self._pid = None
+        self._failed_at = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self):
+        """True once this process has a client; unlike bool(), never tries to create one."""
+        return self._client is not None and self._pid == os.getpid()
+
+    def get(self):
+        """The client, creating it if needed, or None if it cannot be created right now."""
+        if self.initialized:
+            return self._client
+        with self._lock:
+            if self.initialized:
+                return self._client
+            if self._failed_at is not None and self._pid == os.getpid() and time.monotonic() - self._failed_at < self._retry_seconds:
+                return None
+            self._pid = os.getpid()
+            try:
+                self._client = self._factory()
+                self._failed_at, self.error = None, None
+            except Exception as e:
+                print(f"--- ERROR initializing the datastore client: {e} ---")
+                self._client, self._failed_at, self.error = None, time.monotonic(), str(e)
+            return self._client
+
+    def __bool__(self):
+        return self.get() is not None
+
+    def __getattr__(self, name):
+        client = self.get()
+        if client is None:
+            raise RuntimeError(f"Datastore not initialized: {self.error}")
+        return getattr(client, name)
+
+
+class PoolRepository:
+    """
+    Managers, matchups and picks of one pool, stored through either the Firestore client or a
+    LocalClient (both expose the same collection/document/batch API). Routes go through this
+    class instead of building collection references themselves.
+
+    Picks are always handed out as {managerId, matchupId, pickedTeamId, points} dicts, whichever
+    pick_storage format holds them. With 'sheets', a manager without a sheet document is read
+    from the per-pick documents until the pool's pick sheet migration has run.
+    """
+
+    def __init__(self, client, pool, pick_storage='documents'):
+        self.client = client
+        self.pool = pool
+        self.pick_storage = pick_storage
+
+    def collection(self, collection_name):
+        return self.client.collection(self.pool.collection_path(collection_name))
+
+    @property
+    def managers(self):
+        return self.collection('managers')
+
+    @property
+    def matchups(self):
+        return self.collection('matchups')
+
+    @property
+    def picks(self):
+        return self.collection('picks')
+
+    @property
+    def pick_sheets(self):
+        return self.collection('pickSheets')
+
+    @property
+    def uses_sheets(self):
+        return self.pick_storage == 'sheets'
+
+    def reads_legacy_picks(self):
+        """True while per-pick documents may still hold picks not yet copied into sheets."""
+        if not self.uses_sheets:
+            return True
+        if self.pool.pick_sheets_migrated:
+            return False
+        migrated = self.collection('migrations').document(PICK_SHEETS_MIGRATION_ID).get().exists
+        self.pool.pick_sheets_migrated = migrated
+        return not migrated
+
+    # --- Reads ---
+
+    def list_managers(self):
+        return [doc.to_dict() for doc in self.managers.stream()]
+
+    def list_matchups(self):
+        """All matchups, ordered by sortOrder."""
+        return [doc.to_dict() for doc in self.matchups.order_by("sortOrder").stream()]
+
+    def list_picks(self):
+        """Every pick of the pool: one read per pick, or one per manager with pick sheets."""
+        return list(self.stream_picks())
+
+    def list_manager_picks(self, manager_id):
+        """One manager's picks: a query over the picks, or a single document read with pick sheets."""
+        if self.uses_sheets:
+            sheet_doc = self.pick_sheets.document(manager_id).get()
+            if sheet_doc.exists:
+                return pick_sheet_picks(sheet_doc.to_dict())
+            if not self.reads_legacy_picks():
+                return []
+        return [doc.to_dict() for doc in self.picks.where('managerId', '==', manager_id).stream()]
+
+    def stream_picks(self):
+        """Pick dicts one at a time, for exports that should not hold every pick in memory."""
+        sheet_manager_ids = set()
+        if self.uses_sheets:
+            for sheet_doc in self.pick_sheets.stream():
+                sheet_manager_ids.add(sheet_doc.id)
+                yield from pick_sheet_picks(sheet_doc.to_dict())
+            if not self.reads_legacy_picks():
+                return
+        for doc in self.picks.stream():
+            pick = doc.to_dict()
+            if pick.get('managerId') not in sheet_manager_ids:
+                yield pick
+
+    def get_manager(self, manager_id):
+        doc = self.managers.document(manager_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_matchup(self, matchup_id):
+        doc = self.matchups.document(matchup_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def count_picks(self, field, value):
+        """Documents a cascade delete on field == value will touch (used to decide whether it runs in the background)."""
+        count = cascade.count_related_picks(self.picks, field, value)
+        if self.uses_sheets:
+            count += 1 if field == 'managerId' else int(self.pick_sheets.count().get()[0][0].value)
+        return count
+
+    # --- Writes ---
+
+    def create_manager(self, name):
+        manager_id = str(uuid.uuid4())
+        self.managers.document(manager_id).set({'id': manager_id, 'name': name, 'totalScore': 0})
+        return manager_id
+
+    def create_matchup(self, team1_name, team2_name):
+        """Adds a matchup at the end of the list."""
+        matchup_id = str(uuid.uuid4())
+        self.matchups.document(matchup_id).set({
+            'id': matchup_id,
+            'team1Name': team1_name,
+            'team2Name': team2_name,
+            'team1Id': str(uuid.uuid4()),
+            'team2Id': str(uuid.uuid4()),
+            'winnerTeamId': None,
+            'sortOrder': ordering.next_sort_order(self.matchups)
+        })
+        return matchup_id
+
+    def update_matchup(self, matchup_id, team1_name, team2_name, team1_win_probability=None):
+        """Renames the teams and sets the chance that team 1 wins (None means 50/50)."""
+        self.matchups.document(matchup_id).update({'team1Name': team1_name, 'team2Name': team2_name,
+                                                   'team1WinProbability': team1_win_probability})
+
+    def _add_pick_writes(self, batch, manager_id, changed_picks, existing_picks):
+        """Adds the writes for a manager's changed picks to batch; returns how many it added."""
+        if self.uses_sheets:
+            # The whole sheet is rewritten, which also moves a not yet migrated manager to a sheet.
+            sheet = dict(existing_picks or {})
+            sheet.update(changed_picks)
+            batch.set(self.pick_sheets.document(manager_id), pick_sheet_document(manager_id, sheet))
+            return 1
+        for matchup_id, pick_data in changed_picks.items():
+            batch.set(self.picks.document(f"{manager_id}_{matchup_id}"), pick_data)
+        return len(changed_picks)
+
+    def save_pick_sheet(self, manager_id, changed_picks, manager_updates=None, existing_picks=None):
+        """
+        Writes a manager's changed picks (and any manager field updates) in one atomic batch.
+        existing_picks ({matchup_id: pick}, as validated) is needed with pick sheets.
+        """
+        batch = self.client.batch()
+        if changed_picks:
+            self._add_pick_writes(batch, manager_id, changed_picks, existing_picks)
+        if manager_updates:
+            batch.set(self.managers.document(manager_id), manager_updates, merge=True)
+        batch.commit()
+
+    def save_pick_sheets(self, changed_by_manager, existing_by_manager):
+        """Bulk save_pick_sheet for imports: {manager_id: changed picks}, committed in batches of up to 500 writes."""
+        batch, num_writes = self.client.batch(), 0
+        for manager_id, changed_picks in changed_by_manager.items():
+            if num_writes and num_writes + (1 if self.uses_sheets else len(changed_picks)) > MAX_BATCH_WRITES:
+                batch.commit()
+                batch, num_writes = self.client.batch(), 0
+            num_writes += self._add_pick_writes(batch, manager_id, changed_picks, existing_by_manager.get(manager_id))
+        if num_writes:
+            batch.commit()
+
+    # --- Scoring ---
+
+    def apply_winner_changes(self, changes):
+        # Pick sheets cannot be queried by matchup and team, so every sheet is read (one read per manager).
+        picks = self.list_picks() if self.uses_sheets and changes else None
+        return scoring.apply_winner_changes(self.client, self.managers, self.matchups, self.picks, changes, picks=picks)
+
+    def set_winners(self, changes):
+        """Records winners from diff_winners() without touching scores (the caller rebuilds them)."""
+        for matchup_id, (_, winner_team_id) in changes.items():
+            self.matchups.document(matchup_id).update({'winnerTeamId': winner_team_id})
+
+    def recalculate_scores(self):
+        picks = self.list_picks() if self.uses_sheets else None
+        return scoring.recalculate_all_scores(self.client, self.managers, self.matchups, self.picks, picks=picks)
+
+    # --- Matchup order ---
+
+    def move_matchup_step(self, matchup_id, direction):
+        return ordering.move_matchup_step(self.client, self.matchups, matchup_id, direction)
+
+    def move_matchup_after(self, matchup_id, after_id=None):
+        ordering.move_matchup_after(self.client, self.matchups, matchup_id, after_id)
+
+    def reorder_matchups(self, ordered_ids):
+        ordering.reorder_matchups(self.client, self.matchups, ordered_ids)
+
+    def rebalance_sort_orders(self):
+        return ordering.rebalance_sort_orders(self.client, self.matchups)
+
+    def backfill_sort_orders(self):
+        return ordering.backfill_sort_orders(self.client, self.matchups)
+
+    # --- Cascade deletes ---
+
+    def delete_manager_cascade(self, manager_id, progress=None):
+        cascade.delete_manager_cascade(self.client, self.managers, self.picks, manager_id, progress,
+                                       sheets_ref=self.pick_sheets if self.uses_sheets else None)
+
+    def delete_matchup_cascade(self, matchup_id, progress=None):
+        cascade.delete_matchup_cascade(self.client, self.managers, self.matchups, self.picks, matchup_id, progress,
+                                       sheets_ref=self.pick_sheets if self.uses_sheets else None)
+
+
+class AsyncPoolRepository:
+    """
+    The page reads of PoolRepository as coroutines, over an async client: Firestore's AsyncClient,
+    or localstore.AsyncLocalClient. Used by asyncreads.gather() under the ASGI server; every
+    write still goes through PoolRepository.
+    """
+
+    def __init__(self, client, pool, pick_storage='documents'):
+        self.client = client
+        self.pool = pool
+        self.pick_storage = pick_storage
+
+    def collection(self, collection_name):
+        return self.client.collection(self.pool.collection_path(collection_name))
+
+    @property
+    def uses_sheets(self):
+        return self.pick_storage == 'sheets'
+
+    async def reads_legacy_picks(self):
+        if not self.uses_sheets:
+            return True
+        if self.pool.pick_sheets_migrated:
+            return False
+        migrated = (await self.collection('migrations').document(PICK_SHEETS_MIGRATION_ID).get()).exists
+        self.pool.pick_sheets_migrated = migrated
+        return not migrated
+
+    async def list_managers(self):
+        return [doc.to_dict() async for doc in self.collection('managers').stream()]
+
+    async def list_matchups(self):
+        return [doc.to_dict() async for doc in self.collection('matchups').order_by("sortOrder").stream()]
+
+    async def list_picks(self):
+        picks = []
+        sheet_manager_ids = set()
+        if self.uses_sheets:
+            async for sheet_doc in self.collection('pickSheets').stream():
+                sheet_manager_ids.add(sheet_doc.id)
+                picks.extend(pick_sheet_picks(sheet_doc.to_dict()))
+            if not await self.reads_legacy_picks():
+                return picks
+        async for doc in self.collection('picks').stream():
+            pick = doc.to_dict()
+            if pick.get('managerId') not in sheet_manager_ids:
+                picks.append(pick)
+        return picks
+
+    async def list_manager_picks(self, manager_id):
+        if self.uses_sheets:
+            sheet_doc = await self.collection('pickSheets').document(manager_id).get()
+            if sheet_doc.exists:
+                return pick_sheet_picks(sheet_doc.to_dict())
+            if not await self.reads_legacy_picks():
+                return []
+        return [doc.to_dict() async for doc in self.collection('picks').where('managerId', '==', manager_id).stream()]
+
+    async def get_document(self, collection_name, document_id):
+        doc = await self.collection(collection_name).document(document_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    async def get_manager(self, manager_id):
+        return await self.get_document('managers', manager_id)
+
+    async def documents_by_id(self, collection_name):
+        """{document id: data} for a small collection such as 'jobs'."""
+        return {doc.id: doc.to_dict() async for doc in self.collection(collection_name).stream()}
@@ -0,0 +1,107 @@
+# scoring.py
+from firebase_admin import firestore
+
+from batches import MAX_BATCH_WRITES, commit_in_chunks
+
+
+def score_manager_picks(manager_picks, matchups_by_id):
+    """
+    Total points for one manager's picks ({matchup_id: pick}) given the matchups keyed by id.
+    """
+    score = 0
+    for matchup_id, pick in manager_picks.items():
+        matchup = matchups_by_id.get(matchup_id)
+        if matchup and matchup.get('winnerTeamId') is not None and matchup.get('winnerTeamId') == pick.get('pickedTeamId'):
+            score += pick.get('points', 0)
+    return score
+
+
+def diff_winners(all_matchups, submitted_winners):
+    """
+    Compares submitted {matchup_id: winner_team_id} against the stored matchups and returns
+    {matchup_id: (old_winner_team_id, new_winner_team_id)} for the ones that actually change.
+    Winners that are not one of the matchup's two teams are ignored.
+    """
+    matchups_by_id = {m['id']: m for m in all_matchups}
+    changes = {}
+    for matchup_id, winner_team_id in submitted_winners.items():
+        matchup = matchups_by_id.get(matchup_id)
+        if not matchup or winner_team_id not in (matchup.get('team1Id'), matchup.get('team2Id')):
+            continue
+        if matchup.get('winnerTeamId') != winner_team_id:
+            changes[matchup_id] = (matchup.get('winnerTeamId'), winner_team_id)
+    return changes
+
+
+def apply_winner_changes(db, managers_ref, matchups_ref, picks_ref, changes, picks=None):
+    """
+    Applies winner changes from diff_winners() incrementally, in one transaction: it re-reads
+    each changed matchup and keeps only the changes still pending against the stored winner, so
+    a repeated submit (a double-click, two admins) changes nothing. For those it reads only the
+    picks of the old and new winner (one query on the matchupId+pickedTeamId index), turns them
+    into per-manager score deltas and writes the winners plus the deltas. Deltas beyond the 500
+    writes a transaction allows follow in batches. Returns {manager_id: delta}.
+    picks: already loaded pick dicts to use instead of querying picks_ref (pick sheet storage).
+    """
+    if not changes:
+        return {}
+
+    @firestore.transactional
+    def claim_changes(transaction):
+        pending = {}
+        for matchup_id, (_, new_winner) in changes.items():
+            stored = matchups_ref.document(matchup_id).get(transaction=transaction)
+            if not stored.exists:
+                continue
+            old_winner = stored.to_dict().get('winnerTeamId')
+            if old_winner != new_winner:
+                pending[matchup_id] = (old_winner, new_winner)
+
+        score_deltas = {}
+        for matchup_id, (old_winner, new_winner) in pending.items():
+            # Picks of a team that neither won before nor wins now cannot change a score.
+            affected_teams = [team_id for team_id in (old_winner, new_winner) if team_id is not None]
+            if picks is None:
+                picks_query = picks_ref.where('matchupId', '==', matchup_id).where('pickedTeamId', 'in', affected_teams)
+                matchup_picks = (pick_doc.to_dict() for pick_doc in picks_query.stream(transaction=transaction))
+            else:
+                matchup_picks = (pick for pick in picks if pick.get('matchupId') == matchup_id and pick.get('pickedTeamId') in affected_teams)
+            for pick in matchup_picks:
+                points = pick.get('points', 0)
+                delta = 0
+                if old_winner is not None and pick.get('pickedTeamId') == old_winner: delta -= points
+                if pick.get('pickedTeamId') == new_winner: delta += points
+                if delta:
+                    score_deltas[pick['managerId']] = score_deltas.get(pick['managerId'], 0) + delta
+
+        writes = [(matchups_ref.document(matchup_id), {'winnerTeamId': new_winner}) for matchup_id, (_, new_winner) in pending.items()]
+        writes += [(managers_ref.document(manager_id), {'totalScore': firestore.Increment(delta)}) for manager_id, delta in score_deltas.items()]
+        for ref, data in writes[:MAX_BATCH_WRITES]:
+            transaction.update(ref, data)
+        return score_deltas, writes[MAX_BATCH_WRITES:]
+
+    score_deltas, remaining_writes = claim_changes(db.transaction())
+    commit_in_chunks(db, remaining_writes)
+    return score_deltas
+
+
+def recalculate_all_scores(db, managers_ref, matchups_ref, picks_ref, picks=None):
+    """
+    Full rebuild of every manager's totalScore from scratch. Costs one stream of each
+    collection (instead of a query per manager and a get per pick) and only writes the
+    managers whose score actually changed. Returns the number of managers updated.
+    picks: already loaded pick dicts to use instead of streaming picks_ref.
+    """
+    matchups_by_id = {doc.id: doc.to_dict() for doc in matchups_ref.stream()}
+    all_manager_picks = {}
+    for pick in (picks if picks is not None else (pick_doc.to_dict() for pick_doc in picks_ref.stream())):
+        all_manager_picks.setdefault(pick['managerId'], {})[pick['matchupId']] = pick
+
+    writes = []
+    for manager_doc in managers_ref.stream():
+        manager = manager_doc.to_dict()
+        new_score = score_manager_picks(all_manager_picks.get(manager_doc.id, {}), matchups_by_id)
+        if manager.get('totalScore') != new_score:
+            writes.append((manager_doc.reference, {'totalScore': new_score}))
+    commit_in_chunks(db, writes)
+    return len(writes)
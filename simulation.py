@@ -0,0 +1,377 @@
+# simulation.py
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_NUM_SIMULATIONS = 10000
+# Number of simulated seasons scored per NumPy batch. Bounds peak memory to
+# roughly batch_size * (num_matchups + num_managers) floats.
+DEFAULT_BATCH_SIZE = 2048
+# Exact enumeration is never attempted beyond this many deciding matchups (2^24 outcomes).
+EXACT_MAX_MATCHUPS = 24
+# Outcomes of the lowest matchups are enumerated up front as one block; the remaining
+# matchups are walked in Gray-code order so each step only adds or removes one column.
+EXACT_BLOCK_BITS = 12
+# How much more work than Monte Carlo the exact engine may do before 'auto' falls back to sampling.
+EXACT_COST_RATIO = 4
+# Adaptive Monte Carlo: simulations run in chunks (one per worker process per round) until every
+# manager's 95% confidence interval is at most DEFAULT_CI_WIDTH wide, or the cap is reached.
+DEFAULT_CI_WIDTH = 0.01
+DEFAULT_MAX_SIMULATIONS = 200000
+DEFAULT_CHUNK_SIMULATIONS = 4096
+CONFIDENCE_Z = 1.96
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class PickMatrix:
+    """
+    Compiled, array-based view of the pool used by the projection engines.
+    Row i belongs to manager_ids[i], column j to matchup_ids[j] (remaining games only).
+    team1_win_probabilities[j] is the chance that team1 wins matchup j (0.5 unless set).
+    """
+
+    def __init__(self, manager_ids, matchup_ids, base_scores, points, picked_team1, picked_team2, team1_win_probabilities=None):
+        self.manager_ids = manager_ids
+        self.matchup_ids = matchup_ids
+        self.base_scores = base_scores
+        self.points = points
+        self.picked_team1 = picked_team1
+        self.picked_team2 = picked_team2
+        if team1_win_probabilities is None:
+            team1_win_probabilities = np.full(len(matchup_ids), 0.5)
+        self.team1_win_probabilities = team1_win_probabilities
+        # Points each manager earns if team1 / team2 wins each matchup.
+        self.team1_points = np.where(picked_team1, points, 0.0)
+        self.team2_points = np.where(picked_team2, points, 0.0)
+
+    @property
+    def is_uniform(self):
+        """True when every remaining matchup is a 50/50 coin flip."""
+        return bool((self.team1_win_probabilities == 0.5).all())
+
+    @property
+    def num_managers(self):
+        return len(self.manager_ids)
+
+    @property
+    def num_matchups(self):
+        return len(self.matchup_ids)
+
+    def max_possible_scores(self):
+        """Same as standings' maxPossibleScore: current score plus every pending pick."""
+        return self.base_scores + np.where(self.picked_team1 | self.picked_team2, self.points, 0.0).sum(axis=1)
+
+    def subset(self, manager_mask, matchup_mask):
+        return PickMatrix(
+            [mid for mid, keep in zip(self.manager_ids, manager_mask) if keep],
+            [mid for mid, keep in zip(self.matchup_ids, matchup_mask) if keep],
+            self.base_scores[manager_mask],
+            self.points[manager_mask][:, matchup_mask],
+            self.picked_team1[manager_mask][:, matchup_mask],
+            self.picked_team2[manager_mask][:, matchup_mask],
+            self.team1_win_probabilities[matchup_mask],
+        )
+
+    def with_outcomes(self, team1_won):
+        """
+        Matrix with some matchups decided: team1_won is {matchup_id: True if team1 wins}.
+        Points for those matchups move into base_scores and their columns are dropped, so the
+        cached matrix for a pool can answer any what-if question without being rebuilt.
+        """
+        decided = np.array([matchup_id in team1_won for matchup_id in self.matchup_ids], dtype=bool)
+        if not decided.any():
+            return self
+        winners_team1 = np.array([bool(team1_won.get(matchup_id)) for matchup_id in self.matchup_ids], dtype=bool)
+        earned = np.where(winners_team1, self.team1_points, self.team2_points)[:, decided].sum(axis=1)
+        remaining = self.subset(np.ones(self.num_managers, dtype=bool), ~decided)
+        remaining.base_scores = self.base_scores + earned
+        return remaining
+
+
+def build_pick_matrix(all_managers, all_matchups, all_manager_picks):
+    """
+    Builds the manager x matchup points matrix and the picked-side masks for every
+    matchup that does not have a winner yet. Picks that do not match either team are ignored.
+    A matchup's optional 'team1WinProbability' (0-1) weights its outcome; unset means 50/50.
+    """
+    manager_ids = [manager['id'] for manager in all_managers]
+    remaining_matchups = [m for m in all_matchups.values() if m.get('winnerTeamId') is None]
+    matchup_ids = [m['id'] for m in remaining_matchups]
+
+    num_managers = len(manager_ids)
+    num_matchups = len(matchup_ids)
+    base_scores = np.array([manager.get('totalScore', 0) or 0 for manager in all_managers], dtype=np.float64)
+    points = np.zeros((num_managers, num_matchups), dtype=np.float64)
+    picked_team1 = np.zeros((num_managers, num_matchups), dtype=bool)
+    picked_team2 = np.zeros((num_managers, num_matchups), dtype=bool)
+
+    for i, manager_id in enumerate(manager_ids):
+        manager_picks = all_manager_picks.get(manager_id, {})
+        if not manager_picks: continue
+        for j, matchup in enumerate(remaining_matchups):
+            pick = manager_picks.get(matchup['id'])
+            if not pick: continue
+            picked_team_id = pick.get('pickedTeamId')
+            if picked_team_id == matchup['team1Id']:
+                picked_team1[i, j] = True
+            elif picked_team_id == matchup['team2Id']:
+                picked_team2[i, j] = True
+            else:
+                continue
+            points[i, j] = pick.get('points', 0) or 0
+
+    team1_win_probabilities = np.array([_win_probability(m) for m in remaining_matchups], dtype=np.float64)
+    return PickMatrix(manager_ids, matchup_ids, base_scores, points, picked_team1, picked_team2, team1_win_probabilities)
+
+
+def _win_probability(matchup):
+    probability = matchup.get('team1WinProbability')
+    if probability is None:
+        return 0.5
+    return min(max(float(probability), 0.0), 1.0)
+
+
+def count_wins(scores, weights=None):
+    """
+    Given a (num_outcomes, num_managers) score array, returns how many outcomes each
+    manager wins. Managers tied for the top score all share the win, as before.
+    With weights (one per outcome), returns the total weight of the outcomes each manager wins.
+    """
+    max_scores = scores.max(axis=1, keepdims=True)
+    if weights is None:
+        return (scores == max_scores).sum(axis=0)
+    return weights @ (scores == max_scores)
+
+
+def simulate_win_probabilities(pick_matrix, num_simulations=DEFAULT_NUM_SIMULATIONS, seed=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Monte Carlo estimate of each manager's probability of finishing first, with every
+    remaining matchup decided by a (possibly weighted) coin flip. Returns {manager_id: probability (0-1)}.
+    """
+    if pick_matrix.num_managers == 0:
+        return {}
+    if num_simulations <= 0:
+        return {manager_id: 0.0 for manager_id in pick_matrix.manager_ids}
+
+    rng = np.random.default_rng(seed)
+    # score = base + sum(team2 points) + outcome . (team1 points - team2 points)
+    # where outcome[j] is 1 when team1 wins matchup j.
+    constant = pick_matrix.base_scores + pick_matrix.team2_points.sum(axis=1)
+    swing = (pick_matrix.team1_points - pick_matrix.team2_points).T
+    win_counts = np.zeros(pick_matrix.num_managers, dtype=np.int64)
+
+    remaining = num_simulations
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        outcomes = rng.random((size, pick_matrix.num_matchups)) < pick_matrix.team1_win_probabilities
+        scores = outcomes.astype(np.float64) @ swing + constant
+        win_counts += count_wins(scores)
+        remaining -= size
+
+    probabilities = win_counts / num_simulations
+    return dict(zip(pick_matrix.manager_ids, probabilities.tolist()))
+
+
+def _simulate_chunk(constant, swing, team1_win_probabilities, num_simulations, seed_sequence, batch_size=DEFAULT_BATCH_SIZE):
+    """Win counts for one chunk of simulations. Module-level so worker processes can run it."""
+    rng = np.random.default_rng(seed_sequence)
+    win_counts = np.zeros(constant.shape[0], dtype=np.int64)
+    remaining = num_simulations
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        outcomes = rng.random((size, swing.shape[0])) < team1_win_probabilities
+        win_counts += count_wins(outcomes.astype(np.float64) @ swing + constant)
+        remaining -= size
+    return win_counts
+
+
+def confidence_margins(win_counts, num_simulations, z=CONFIDENCE_Z):
+    """
+    Half-width of each manager's confidence interval (Agresti-Coull), so a manager who has
+    not won a single simulation yet still gets a non-zero margin.
+    """
+    adjusted_n = num_simulations + z * z
+    adjusted_p = (win_counts + z * z / 2) / adjusted_n
+    return z * np.sqrt(adjusted_p * (1 - adjusted_p) / adjusted_n)
+
+
+def get_executor(max_workers=None):
+    """
+    Shared process pool for simulation chunks, created on first use. Workers are spawned,
+    not forked, because the web worker that calls this already runs Firestore/gRPC threads.
+    Returns None when only one core is available (chunks then run in-process).
+    """
+    global _executor
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers <= 1:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def simulate_until_confident(pick_matrix, ci_width=DEFAULT_CI_WIDTH, max_simulations=DEFAULT_MAX_SIMULATIONS, seed=None,
+                             chunk_size=DEFAULT_CHUNK_SIMULATIONS, executor=None, num_workers=1):
+    """
+    Adaptive Monte Carlo. Each round runs num_workers chunks of chunk_size simulations (on
+    executor when given), each with its own RNG stream spawned from one SeedSequence, and
+    merges their win counts. Stops as soon as every manager's confidence interval is at most
+    ci_width wide, or after max_simulations.
+    Returns ({manager_id: probability}, {manager_id: margin}, simulations run).
+    """
+    if pick_matrix.num_managers == 0:
+        return {}, {}, 0
+
+    constant = pick_matrix.base_scores + pick_matrix.team2_points.sum(axis=1)
+    swing = (pick_matrix.team1_points - pick_matrix.team2_points).T
+    probabilities = pick_matrix.team1_win_probabilities
+    seed_sequence = np.random.SeedSequence(seed)
+    win_counts = np.zeros(pick_matrix.num_managers, dtype=np.int64)
+    num_simulations = 0
+    margins = np.ones(pick_matrix.num_managers)
+
+    while num_simulations < max_simulations:
+        sizes = []
+        for _ in range(max(num_workers, 1)):
+            size = min(chunk_size, max_simulations - num_simulations - sum(sizes))
+            if size <= 0:
+                break
+            sizes.append(size)
+        streams = seed_sequence.spawn(len(sizes))
+        if executor is not None and len(sizes) > 1:
+            futures = [executor.submit(_simulate_chunk, constant, swing, probabilities, size, stream) for size, stream in zip(sizes, streams)]
+            chunk_counts = [future.result() for future in futures]
+        else:
+            chunk_counts = [_simulate_chunk(constant, swing, probabilities, size, stream) for size, stream in zip(sizes, streams)]
+        for counts in chunk_counts:
+            win_counts += counts
+        num_simulations += sum(sizes)
+
+        margins = confidence_margins(win_counts, num_simulations)
+        if 2 * margins.max() <= ci_width:
+            break
+
+    win_probabilities = win_counts / num_simulations
+    return (dict(zip(pick_matrix.manager_ids, win_probabilities.tolist())),
+            dict(zip(pick_matrix.manager_ids, margins.tolist())), num_simulations)
+
+
+def prune_pick_matrix(pick_matrix):
+    """
+    Drops managers who are mathematically eliminated (their max possible score is below
+    another manager's guaranteed current score) and matchups that cannot change the
+    ranking of the remaining contenders (every contender gains the same amount either way).
+    Matchups whose win probability is 0 or 1 are treated as already decided.
+    """
+    certain = (pick_matrix.team1_win_probabilities == 0) | (pick_matrix.team1_win_probabilities == 1)
+    if certain.any():
+        pick_matrix = pick_matrix.with_outcomes({
+            matchup_id: bool(probability == 1)
+            for matchup_id, probability, is_certain in zip(pick_matrix.matchup_ids, pick_matrix.team1_win_probabilities, certain) if is_certain})
+    contenders = pick_matrix.max_possible_scores() >= pick_matrix.base_scores.max(initial=0)
+    swing = pick_matrix.team1_points[contenders] - pick_matrix.team2_points[contenders]
+    if swing.shape[0] > 0:
+        deciding = (swing != swing[0]).any(axis=0)
+    else:
+        deciding = np.zeros(pick_matrix.num_matchups, dtype=bool)
+    return pick_matrix.subset(contenders, deciding)
+
+
+def exact_win_probabilities(pick_matrix):
+    """
+    Enumerates all 2^k outcomes of the remaining matchups and returns each manager's exact
+    probability of finishing first (ties share the win). Intended for small k only.
+    Outcomes are weighted by the matchups' win probabilities unless every one is 50/50.
+    """
+    if pick_matrix.num_managers == 0:
+        return {}
+    num_matchups = pick_matrix.num_matchups
+    if num_matchups > EXACT_MAX_MATCHUPS:
+        raise ValueError(f"Too many remaining matchups ({num_matchups}) for exact enumeration.")
+
+    constant = pick_matrix.base_scores + pick_matrix.team2_points.sum(axis=1)
+    swing = (pick_matrix.team1_points - pick_matrix.team2_points).T
+
+    # Every combination of the low block, scored at once: (2^block_bits, num_managers).
+    block_bits = min(num_matchups, EXACT_BLOCK_BITS)
+    block_outcomes = (np.arange(2 ** block_bits)[:, None] >> np.arange(block_bits)) & 1
+    block_scores = block_outcomes.astype(np.float64) @ swing[:block_bits] + constant
+    weighted = not pick_matrix.is_uniform
+    team1_p = pick_matrix.team1_win_probabilities
+    block_weights = np.where(block_outcomes, team1_p[:block_bits], 1 - team1_p[:block_bits]).prod(axis=1) if weighted else None
+
+    # Walk the high matchups in Gray-code order: consecutive outcomes differ in one game,
+    # so the score offset changes by a single row of the swing matrix.
+    high_swing = swing[block_bits:]
+    high_bits = num_matchups - block_bits
+    high_state = np.zeros(high_bits, dtype=bool)
+    offset = np.zeros(pick_matrix.num_managers, dtype=np.float64)
+    high_p = team1_p[block_bits:]
+    win_counts = count_wins(block_scores, block_weights * np.prod(1 - high_p) if weighted else None)
+    for step in range(1, 2 ** high_bits):
+        bit = (step & -step).bit_length() - 1
+        high_state[bit] = not high_state[bit]
+        if high_state[bit]:
+            offset += high_swing[bit]
+        else:
+            offset -= high_swing[bit]
+        if weighted:
+            win_counts += count_wins(block_scores + offset, block_weights * np.where(high_state, high_p, 1 - high_p).prod())
+        else:
+            win_counts += count_wins(block_scores + offset)
+
+    probabilities = win_counts if weighted else win_counts / float(2 ** num_matchups)
+    return dict(zip(pick_matrix.manager_ids, probabilities.tolist()))
+
+
+def choose_projection_method(pick_matrix, num_simulations=DEFAULT_NUM_SIMULATIONS):
+    """
+    Picks 'exact' when enumerating every outcome costs about as much as sampling would.
+    Both engines are dominated by scoring each outcome against every manager, so exact
+    costs ~2^k rows and Monte Carlo ~num_simulations rows. Exact is allowed to be
+    EXACT_COST_RATIO times more expensive since it has no sampling noise at all.
+    """
+    num_matchups = pick_matrix.num_matchups
+    if num_matchups > EXACT_MAX_MATCHUPS:
+        return 'monte_carlo'
+    if 2 ** num_matchups <= max(num_simulations, 1) * EXACT_COST_RATIO:
+        return 'exact'
+    return 'monte_carlo'
+
+
+def project_win_probabilities(pick_matrix, num_simulations=DEFAULT_NUM_SIMULATIONS, seed=None, method='auto',
+                              ci_width=None, max_simulations=DEFAULT_MAX_SIMULATIONS, num_workers=None):
+    """
+    Returns ({manager_id: probability}, details). Eliminated managers are pruned up front and
+    reported as 0; the exact or Monte Carlo engine is chosen by cost unless forced.
+    With ci_width set, Monte Carlo runs adaptively (see simulate_until_confident) on up to
+    num_workers processes; otherwise it runs exactly num_simulations simulations.
+    details: {'method', 'num_simulations' (simulations run, 0 for exact), 'margins' ({manager_id: margin})}.
+    """
+    probabilities = {manager_id: 0.0 for manager_id in pick_matrix.manager_ids}
+    margins = {manager_id: 0.0 for manager_id in pick_matrix.manager_ids}
+    pruned = prune_pick_matrix(pick_matrix)
+    if method == 'auto':
+        method = choose_projection_method(pruned, num_simulations)
+    if method == 'exact':
+        probabilities.update(exact_win_probabilities(pruned))
+        simulations_run = 0
+    elif ci_width:
+        num_workers = num_workers or os.cpu_count() or 1
+        simulated, simulated_margins, simulations_run = simulate_until_confident(
+            pruned, ci_width=ci_width, max_simulations=max_simulations, seed=seed,
+            executor=get_executor(num_workers), num_workers=num_workers)
+        probabilities.update(simulated)
+        margins.update(simulated_margins)
+    else:
+        probabilities.update(simulate_win_probabilities(pruned, num_simulations=num_simulations, seed=seed))
+        simulations_run = num_simulations
+        win_counts = np.array([probabilities[manager_id] for manager_id in pruned.manager_ids]) * num_simulations
+        margins.update(zip(pruned.manager_ids, confidence_margins(win_counts, max(num_simulations, 1)).tolist()))
+    return probabilities, {'method': method, 'num_simulations': simulations_run, 'margins': margins}
@@ -0,0 +1,145 @@
+# snapshots.py
+from datetime import datetime, timezone
+import fcntl
+import json
+import os
+
+from firebase_admin import firestore
+
+from simulation import build_pick_matrix, project_win_probabilities, DEFAULT_MAX_SIMULATIONS, DEFAULT_NUM_SIMULATIONS
+
+
+def group_picks_by_manager(all_picks):
+    """{manager_id: {matchup_id: pick}} from a flat list of pick dicts."""
+    all_manager_picks = {}
+    for pick in all_picks:
+        all_manager_picks.setdefault(pick['managerId'], {})[pick['matchupId']] = pick
+    return all_manager_picks
+
+
+def build_standings(all_managers, all_matchups, all_manager_picks):
+    """
+    Standings rows sorted by totalScore. all_matchups is keyed by matchup id.
+    """
+    standings_data = []
+    for manager in all_managers:
+        manager_id = manager['id']
+        tieBreaker = manager.get('tieBreakerScore', 0)
+        total_score = manager.get('totalScore', 0)
+        max_possible_score = total_score
+        manager_picks = all_manager_picks.get(manager_id, {})
+        for matchup_id, pick_data in manager_picks.items():
+            matchup = all_matchups.get(matchup_id)
+            if matchup and matchup.get('winnerTeamId') is None:
+                max_possible_score += pick_data.get('points', 0)
+        standings_data.append({
+            'id': manager_id, 'name': manager['name'], 'totalScore': total_score, 'maxPossibleScore': max_possible_score, 'tieBreakerScore': tieBreaker
+        })
+    standings_data.sort(key=lambda x: x['totalScore'], reverse=True)
+    return standings_data
+
+
+def build_projections(all_managers, all_matchups, all_manager_picks, num_simulations=DEFAULT_NUM_SIMULATIONS, seed=None, method='auto',
+                      ci_width=None, max_simulations=DEFAULT_MAX_SIMULATIONS, num_workers=None):
+    """
+    Returns (projection rows sorted by probability, projection info for the template).
+    Each row carries the 95% margin of error of its probability (0 when exact).
+    """
+    pick_matrix = build_pick_matrix(all_managers, all_matchups, all_manager_picks)
+    win_probabilities, details = project_win_probabilities(
+        pick_matrix, num_simulations=num_simulations, seed=seed, method=method,
+        ci_width=ci_width, max_simulations=max_simulations, num_workers=num_workers)
+
+    projection_info = {'projection_method': details['method'], 'num_simulations': details['num_simulations'],
+                       'num_remaining': pick_matrix.num_matchups, 'ci_width': ci_width,
+                       'weighted': not pick_matrix.is_uniform}
+    return projection_rows(all_managers, win_probabilities, details['margins']), projection_info
+
+
+def projection_rows(all_managers, win_probabilities, margins):
+    """Projection table rows ({name, probability, margin} as percentages), most likely winner first."""
+    projections = []
+    for manager in all_managers:
+        probability = win_probabilities.get(manager['id'], 0) * 100
+        margin = margins.get(manager['id'], 0) * 100
+        projections.append({'id': manager['id'], 'name': manager['name'], 'probability': f"{probability:.2f}%", 'margin': f"{margin:.2f}%"})
+    projections.sort(key=lambda x: float(x['probability'].strip('%')), reverse=True)
+    return projections
+
+
+def materialize_snapshot(store, all_managers, all_matchups, all_picks, num_simulations=DEFAULT_NUM_SIMULATIONS, seed=None, method='auto',
+                         ci_width=None, max_simulations=DEFAULT_MAX_SIMULATIONS, num_workers=None):
+    """
+    Recomputes standings and projections from the given collections and saves them to store
+    as the next snapshot version (assigned by the store). all_matchups is a list of matchup dicts.
+    """
+    matchups_by_id = {m['id']: m for m in all_matchups}
+    all_manager_picks = group_picks_by_manager(all_picks)
+    projections, projection_info = build_projections(all_managers, matchups_by_id, all_manager_picks,
+                                                     num_simulations=num_simulations, seed=seed, method=method,
+                                                     ci_width=ci_width, max_simulations=max_simulations, num_workers=num_workers)
+    snapshot = {
+        'generatedAt': datetime.now(timezone.utc).isoformat(),
+        'standings': build_standings(all_managers, matchups_by_id, all_manager_picks),
+        'projections': projections,
+        'projectionInfo': projection_info,
+    }
+    store.save_next(snapshot)
+    return snapshot
+
+
+class FirestoreSnapshotStore:
+    """Keeps the latest snapshot in a single Firestore document (one read per load)."""
+
+    def __init__(self, doc_ref, client):
+        self.doc_ref = doc_ref
+        self.client = client
+
+    def load(self):
+        doc = self.doc_ref.get()
+        return doc.to_dict() if doc.exists else None
+
+    def save_next(self, snapshot):
+        """
+        Stores snapshot as the version after the stored one. The version is read and written in
+        one transaction, so workers or instances saving at the same time never share a version.
+        """
+        @firestore.transactional
+        def save(transaction):
+            doc = self.doc_ref.get(transaction=transaction)
+            snapshot['version'] = (doc.to_dict()['version'] + 1) if doc.exists else 1
+            transaction.set(self.doc_ref, snapshot)
+
+        save(self.client.transaction())
+
+
+class FileSnapshotStore:
+    """
+    Keeps the latest snapshot in a local JSON file. Only suitable for a single instance,
+    since other instances will not see the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_next(self, snapshot):
+        """Stores snapshot as the version after the stored one, under a file lock shared by the instance's workers."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            previous = self.load()
+            snapshot['version'] = (previous['version'] + 1) if previous else 1
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(snapshot, f)
+            # Atomic swap so readers never see a half-written snapshot.
+            os.replace(temp_path, self.path)
@@ -0,0 +1,213 @@
+# transfer.py
+import csv
+import io
+import tempfile
+import zipfile
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from picksheet import PickSheetError, validate_pick_sheet
+
+# Rows parsed per pandas chunk when reading CSV uploads.
+CHUNK_ROWS = 1000
+# Bytes buffered before a chunk of CSV is sent to the client.
+CSV_FLUSH_BYTES = 64 * 1024
+# Only the first problems are reported back; a bad 10k-row file would otherwise produce a huge page.
+MAX_REPORTED_PROBLEMS = 50
+
+PICK_COLUMNS = ['manager_id', 'manager_name', 'matchup_id', 'team1_name', 'team2_name', 'picked_team_id', 'picked_team_name', 'points']
+RESULT_COLUMNS = ['matchup_id', 'team1_name', 'team2_name', 'winner_team_id', 'winner_team_name']
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# What reading a malformed upload can raise (a '.xlsx' that is not a workbook is not a ValueError).
+UPLOAD_READ_ERRORS = (ValueError, KeyError, zipfile.BadZipFile, InvalidFileException)
+
+
+class TransferError(ValueError):
+    """Raised when an uploaded file is rejected. Nothing from the file has been written."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        shown = problems[:MAX_REPORTED_PROBLEMS]
+        if len(problems) > len(shown):
+            shown = shown + [f"...and {len(problems) - len(shown)} more."]
+        super().__init__(" ".join(shown))
+
+
+# --- Export ---
+
+def _team_name(matchup, team_id):
+    if team_id == matchup.get('team1Id'): return matchup.get('team1Name')
+    if team_id == matchup.get('team2Id'): return matchup.get('team2Name')
+    return ''
+
+
+def iter_pick_rows(picks, managers_by_id, matchups_by_id):
+    """Export rows for a stream of pick dicts, one row at a time."""
+    for pick in picks:
+        manager = managers_by_id.get(pick.get('managerId'), {})
+        matchup = matchups_by_id.get(pick.get('matchupId'), {})
+        yield [pick.get('managerId'), manager.get('name', ''), pick.get('matchupId'), matchup.get('team1Name', ''), matchup.get('team2Name', ''),
+               pick.get('pickedTeamId'), _team_name(matchup, pick.get('pickedTeamId')), pick.get('points')]
+
+
+def iter_result_rows(all_matchups):
+    for matchup in all_matchups:
+        winner_team_id = matchup.get('winnerTeamId') or ''
+        yield [matchup['id'], matchup.get('team1Name'), matchup.get('team2Name'), winner_team_id, _team_name(matchup, winner_team_id) if winner_team_id else '']
+
+
+def stream_csv(header, rows):
+    """Generator of CSV text chunks, so the response is sent while rows are still being read."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_xlsx(header, rows):
+    """
+    Generator of XLSX bytes. The workbook is built in openpyxl's write-only mode (rows are
+    flushed as they are added) into a temporary file, which is then sent in chunks.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(CSV_FLUSH_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+# --- Import ---
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def iter_upload_rows(file_storage):
+    """
+    Yields each row of an uploaded CSV or XLSX file as {column: text}. CSV is read in pandas
+    chunks and XLSX in openpyxl read-only mode, so the whole file is never parsed at once.
+    """
+    if (file_storage.filename or '').lower().endswith('.xlsx'):
+        workbook = load_workbook(file_storage.stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [_cell_text(cell) for cell in next(rows, [])]
+            for values in rows:
+                if all(value is None for value in values): continue
+                yield {column: _cell_text(value) for column, value in zip(header, values)}
+        finally:
+            workbook.close()
+    else:
+        for chunk in pd.read_csv(file_storage.stream, chunksize=CHUNK_ROWS, dtype=str, keep_default_na=False):
+            for row in chunk.to_dict('records'):
+                yield {str(column).strip(): _cell_text(value) for column, value in row.items()}
+
+
+def _resolve_team(matchup, team_id, team_name):
+    if team_id:
+        return team_id
+    for key in ('team1', 'team2'):
+        if (matchup.get(f'{key}Name') or '').strip().lower() == team_name.lower():
+            return matchup.get(f'{key}Id')
+    return team_name
+
+
+def validate_pick_import(rows, all_managers, all_matchups, all_picks):
+    """
+    Checks picks from export-format rows. Managers may be given by manager_id or manager_name
+    and teams by picked_team_id or picked_team_name. Each manager's resulting sheet is
+    checked with the same rules as save_pick; if any row or sheet is invalid, TransferError
+    lists every problem. Returns only the picks that change, as {manager_id: {matchup_id: pick}},
+    for PoolRepository.save_pick_sheets().
+    """
+    managers_by_id = {m['id']: m for m in all_managers}
+    managers_by_name = {}
+    for manager in all_managers:
+        managers_by_name.setdefault((manager.get('name') or '').strip().lower(), []).append(manager['id'])
+    matchups_by_id = {m['id']: m for m in all_matchups}
+
+    problems = []
+    submitted = {}
+    for line_number, row in enumerate(rows, start=2):
+        manager_id = row.get('manager_id', '')
+        if not manager_id:
+            candidates = managers_by_name.get(row.get('manager_name', '').lower(), [])
+            if len(candidates) != 1:
+                problems.append(f"Row {line_number}: manager '{row.get('manager_name', '')}' is {'ambiguous' if candidates else 'unknown'}.")
+                continue
+            manager_id = candidates[0]
+        if manager_id not in managers_by_id:
+            problems.append(f"Row {line_number}: manager {manager_id} does not exist.")
+            continue
+        matchup_id = row.get('matchup_id', '')
+        matchup = matchups_by_id.get(matchup_id, {})
+        picked_team_id = _resolve_team(matchup, row.get('picked_team_id', ''), row.get('picked_team_name', ''))
+        sheet = submitted.setdefault(manager_id, {})
+        if matchup_id in sheet:
+            problems.append(f"Row {line_number}: duplicate pick for this manager and matchup.")
+            continue
+        # Only compact tuples are kept per row; field checks happen in validate_pick_sheet below.
+        sheet[matchup_id] = (picked_team_id, row.get('points', ''))
+
+    existing_by_manager = {}
+    for pick in all_picks:
+        existing_by_manager.setdefault(pick['managerId'], {})[pick['matchupId']] = pick
+
+    changed_by_manager = {}
+    for manager_id, sheet in submitted.items():
+        try:
+            changed_picks = validate_pick_sheet(manager_id, all_matchups, existing_by_manager.get(manager_id, {}), sheet)
+        except PickSheetError as e:
+            problems.extend(f"{managers_by_id[manager_id].get('name')}: {problem}" for problem in e.problems)
+            continue
+        if changed_picks:
+            changed_by_manager[manager_id] = changed_picks
+
+    if problems:
+        raise TransferError(problems)
+    return changed_by_manager
+
+
+def parse_results(rows, all_matchups):
+    """
+    Reads a results file into {matchup_id: winner_team_id} for diff_winners(). Rows without a
+    winner are skipped; winners may be given by winner_team_id or winner_team_name.
+    """
+    matchups_by_id = {m['id']: m for m in all_matchups}
+    problems = []
+    submitted_winners = {}
+    for line_number, row in enumerate(rows, start=2):
+        matchup = matchups_by_id.get(row.get('matchup_id', ''))
+        if not matchup:
+            problems.append(f"Row {line_number}: matchup '{row.get('matchup_id', '')}' does not exist.")
+            continue
+        if not row.get('winner_team_id') and not row.get('winner_team_name'):
+            continue
+        winner_team_id = _resolve_team(matchup, row.get('winner_team_id', ''), row.get('winner_team_name', ''))
+        if winner_team_id not in (matchup.get('team1Id'), matchup.get('team2Id')):
+            problems.append(f"Row {line_number}: winner is not one of {matchup.get('team1Name')} or {matchup.get('team2Name')}.")
+            continue
+        submitted_winners[matchup['id']] = winner_team_id
+    if problems:
+        raise TransferError(problems)
+    return submitted_winners
@@ -0,0 +1,55 @@
+# whatif.py
+from simulation import DEFAULT_CHUNK_SIMULATIONS, project_win_probabilities
+from snapshots import projection_rows
+
+# What-if answers trade a little precision for latency: a wider interval and a lower cap than
+# the stored projections, and no process pool (its round trip costs more than the work).
+WHAT_IF_CI_WIDTH = 0.02
+WHAT_IF_MAX_SIMULATIONS = 50000
+
+
+class WhatIfError(ValueError):
+    """Raised for forced outcomes that cannot be applied. problems lists every reason."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(" ".join(problems))
+
+
+def resolve_forced_outcomes(matchups_by_id, submitted_winners):
+    """
+    Turns {matchup_id: winner_team_id} into {matchup_id: True if team1 wins} for
+    PickMatrix.with_outcomes(). Decided matchups can only be "forced" to their actual winner,
+    which changes nothing, so they are left out.
+    """
+    problems = []
+    team1_won = {}
+    for matchup_id, winner_team_id in submitted_winners.items():
+        matchup = matchups_by_id.get(matchup_id)
+        if not matchup:
+            problems.append(f"Matchup {matchup_id} does not exist.")
+        elif winner_team_id not in (matchup.get('team1Id'), matchup.get('team2Id')):
+            problems.append(f"{winner_team_id} is not playing in {matchup.get('team1Name')} vs {matchup.get('team2Name')}.")
+        elif matchup.get('winnerTeamId') is not None:
+            if matchup['winnerTeamId'] != winner_team_id:
+                problems.append(f"{matchup.get('team1Name')} vs {matchup.get('team2Name')} is already decided.")
+        else:
+            team1_won[matchup_id] = winner_team_id == matchup['team1Id']
+    if problems:
+        raise WhatIfError(problems)
+    return team1_won
+
+
+def project_what_if(pick_matrix, all_managers, team1_won, seed=None, ci_width=WHAT_IF_CI_WIDTH, max_simulations=WHAT_IF_MAX_SIMULATIONS):
+    """
+    Projections with some outcomes forced, from an already compiled pick matrix.
+    Returns (projection rows, projection info), shaped like the snapshot's.
+    """
+    scenario = pick_matrix.with_outcomes(team1_won)
+    # Exact enumeration is only chosen when it is about as cheap as one chunk of simulations.
+    win_probabilities, details = project_win_probabilities(scenario, num_simulations=DEFAULT_CHUNK_SIMULATIONS, seed=seed,
+                                                           ci_width=ci_width, max_simulations=max_simulations, num_workers=1)
+    projection_info = {'projection_method': details['method'], 'num_simulations': details['num_simulations'],
+                       'num_remaining': scenario.num_matchups, 'ci_width': ci_width,
+                       'weighted': not scenario.is_uniform}
+    return projection_rows(all_managers, win_probabilities, details['margins']), projection_info